@@ -12,6 +12,15 @@
 #-------------------------------------------------------------------------------
 
 from collections import namedtuple
+from functools import lru_cache
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import png
+except ImportError:
+    png = None
 _exportcontainer = namedtuple("N2D", ['width', 'height', 'image', 'palette'])
 export_pattern = _exportcontainer._make((0, 0, None, None,))
 
@@ -35,50 +44,113 @@ def unpackRGB(data, bitdepth=None, order='rgba', src='rgba'):
     while len(o)<4:
         o.append(-1)
 
-    out = bytearray()
     if bitdepth==32:
         if order==src:
             return data
         else:
             if isinstance(data, array):
                 data = data.tobytes()
-            for i in range(0, len(data), 4):
-                for j in o:
-                    if j>=0:
-                        out.append(data[i:i+4][j])
-                    else:
-                        out.append(0)
+            return _reorder(data, 4, o)
     elif bitdepth==24:
         # Set alpha as a placeholder.
         if isinstance(data, array):
             data.byteswap()
             data = data.tobytes()
-        for i in range(0, len(data), 3):
-            for j in o:
-                if j>=0:
-                    out.append(data[i:i+3][j])
-                else:
-                    out.append(0)
+        return _reorder(data, 3, o)
     elif bitdepth==16:
         # Unpack into 8bit components
         if isinstance(data, (bytes, bytearray)):
             data = array("H", data)
             data.byteswap()
-        for c in data:
-            clr = dict(r=0, g=0, b=0, a=0)
-            for j in reversed(src):
-                if j=='a':
-                    clr['a'] = 0xFF if c&1 else 0
-                    c>>=1
-                else:
-                    v = (c&0x1F)<<3
-                    v|= v>>5
-                    clr[j] = v
-                    c>>=5
-            for j in order:
-                out.append(clr.get(j, 0))
+        if numpy is not None:
+            return _unpack16_numpy(data, order, src)
+        if (len(data) >= _rgb16TableMin) or ((order, src) in _rgb16Tables):
+            t = _rgb16Table(order, src)
+            return bytearray(b''.join(map(t.__getitem__, data)))
+        return _unpack16(data, order, src)
+    return bytearray()
+
+def _reorder(data, width, o):
+    """Picks channel o[k] of every width-byte pixel in data as channel k
+    of the output, or 0 where o[k] is out of range.
+    Each channel is copied for the whole image with one extended slice."""
+    n = len(data)//width
+    out = bytearray(n*len(o))
+    for k, j in enumerate(o):
+        if 0 <= j < width:
+            out[k::len(o)] = data[j:n*width:width]
     return out
 
+def _unpack16(data, order, src):
+    """Pure Python conversion of 16bit values in data; see unpackRGB."""
+    out = bytearray()
+    for c in data:
+        clr = dict(r=0, g=0, b=0, a=0)
+        for j in reversed(src):
+            if j=='a':
+                clr['a'] = 0xFF if c&1 else 0
+                c>>=1
+            else:
+                v = (c&0x1F)<<3
+                v|= v>>5
+                clr[j] = v
+                c>>=5
+        for j in order:
+            out.append(clr.get(j, 0))
+    return out
+
+def _fields16(src):
+    """Maps each channel in src to its (shift, bits) in a 16bit value.
+    'a' is one bit, all others five, packed from the end of src up."""
+    fields = {}
+    shift = 0
+    for j in reversed(src):
+        bits = 1 if j=='a' else 5
+        fields[j] = (shift, bits)
+        shift += bits
+    return fields
+
+# 16bit images with at least this many pixels are converted with a lookup
+# table of all 65536 values; once built a table is used for any size.
+_rgb16TableMin = 4096
+_rgb16Tables = {}
+
+def _rgb16Table(order, src):
+    """Returns a list mapping every 16bit value to its output pixel bytes."""
+    t = _rgb16Tables.get((order, src))
+    if t is None:
+        fields = _fields16(src)
+        expand = [((v<<3) | (v>>2)) for v in range(32)]
+        values = range(0x10000)
+        channels = []
+        for j in order:
+            if j not in fields:
+                channels.append([0]*0x10000)
+                continue
+            shift, bits = fields[j]
+            if bits == 1:
+                channels.append([0xFF if (c>>shift)&1 else 0 for c in values])
+            else:
+                channels.append([expand[(c>>shift)&0x1F] for c in values])
+        t = _rgb16Tables[(order, src)] = list(map(bytes, zip(*channels)))
+    return t
+
+def _unpack16_numpy(data, order, src):
+    """NumPy conversion of 16bit values in data; see unpackRGB."""
+    v = numpy.frombuffer(data, dtype=numpy.uint16)
+    fields = _fields16(src)
+    out = numpy.zeros((len(v), len(order)), dtype=numpy.uint8)
+    for k, j in enumerate(order):
+        if j not in fields:
+            continue
+        shift, bits = fields[j]
+        if bits == 1:
+            out[:, k] = ((v >> shift) & 1) * 0xFF
+        else:
+            c = (v >> shift) & 0x1F
+            out[:, k] = (c << 3) | (c >> 2)
+    return bytearray(out.tobytes())
+
 def packRGB(data, newdepth, srcdepth, order='rgba', src='rgba', **kwargs):
     """Converts a bytearray of channel data to given bitdepth and order.
     Returns a bytearray with merged channels.
@@ -168,28 +240,85 @@ def packRGB(data, newdepth, srcdepth, order='rgba', src='rgba', **kwargs):
     return out
 
 def redepth(data, org, depth):
+    """Converts packed samples of org bits to packed samples of depth bits,
+    most significant first. Samples are truncated when reducing depth and
+    copied unscaled when increasing it; trailing bits short of a byte are
+    dropped. Uses a table of the output bits for each of the 256 bytes."""
     if org == depth:
         return data
 
-    out = bytearray()
     m = (1 << org) - 1
     c = max(org - depth, 0)
-    v = 1
     if org > 8 or depth > 8:
         raise NotImplementedError
-    else:
-        for j in data:
-            # Read each sample from bytes data.
-            for k in range(8, 0, -org):
-                k-=org
-                v <<= depth
-                j = (j>>k) & m
-                v |= j >> c
-                if v.bit_length() > 8:
-                    out.append(v & 0xFF)
-                    v = 1
-    return bytes(out)
+    # Output bits for each input byte, from its samples read top down.
+    bits = (8//org) * depth
+    t = []
+    for j in range(256):
+        v = 0
+        for k in range(8-org, -1, -org):
+            v <<= depth
+            v |= ((j>>k) & m) >> c
+        t.append(v)
+    size = (len(data)*bits) >> 3
+    if bits & 7 == 0:
+        # Whole output bytes per input byte: one translate per output byte.
+        w = bits >> 3
+        out = bytearray(len(data)*w)
+        data = bytes(data)
+        for i in range(w):
+            s = 8*(w-1-i)
+            out[i::w] = data.translate(bytes((v>>s) & 0xFF for v in t))
+        return bytes(out)
+    if size == 0:
+        return b''
+    f = "{{:0{}b}}".format(bits)
+    t = [f.format(v) for v in t]
+    v = int(''.join(map(t.__getitem__, data)), 2) >> ((len(data)*bits) & 7)
+    return v.to_bytes(size, byteorder='big')
+
+def _splitbyte(i, mode):
+    """Returns the output bytes of splitter for a single byte i."""
+    out = bytearray()
+    if mode in ('ia8', 'i4'):
+        g = (i>>4) | (i&0xF0)
+        out.append(g)
+        g = i&0xF
+        out.append(g | (g<<4))
+    elif mode == 'ci4':
+        out.append(i>>4)
+        out.append(i&0xF)
+    elif mode == 'ia4':
+        # 3bit grey, 1 bit alpha.
+        for g in (i>>4, i&0xF):
+            a = 0xFF if g&1 else 0
+            g&= (~1)
+            g|= g<<4
+            out.append(g)
+            out.append(a)
+    elif mode == 'i24':
+        a = (i>>6) & 3
+        b = (i>>4) & 3
+        c = (i>>2) & 3
+        d = (a<<12) | (b<<8) | (c<<4) | (i&3)
+        d|= d<<2
+        out.extend(d.to_bytes(2, byteorder='big'))
+    elif mode == 'i28':
+        a = (i>>6) & 3
+        b = (i>>4) & 3
+        c = (i>>2) & 3
+        d = (a<<24) | (b<<16) | (c<<8) | (i&3)
+        d|= d<<2
+        d|= d<<4
+        out.extend(d.to_bytes(4, byteorder='big'))
+    return out
 
+# For each splitter mode, one bytes.translate table per output byte.
+_splittables = {}
+for _mode in ('ia8', 'i4', 'ci4', 'ia4', 'i24', 'i28'):
+    _b = [_splitbyte(i, _mode) for i in range(256)]
+    _splittables[_mode] = [bytes(j[k] for j in _b) for k in range(len(_b[0]))]
+del _mode, _b
 
 def splitter(data, mode):
     """If mode ci4:     UL -> 0U 0L
@@ -198,51 +327,21 @@ def splitter(data, mode):
     if mode i28:        11223344 -> 11 22 33 44
     if mode i24:        11223344 -> 12 34
     """
-    out = bytearray()
-    if mode in ('ia8', 'i4'):
-        for i in data:
-            g = (i>>4) | (i&0xF0)
-            out.append(g)
-            g = i&0xF
-            out.append(g | (g<<4))
-    elif mode == 'ci4':
-        for i in data:
-            out.append(i>>4)
-            out.append(i&0xF)
-    elif mode == 'ia4':
-        # 3bit grey, 1 bit alpha.
-        for i in data:
-            for g in (i>>4, i&0xF):
-                a = 0xFF if g&1 else 0
-                g&= (~1)
-                g|= g<<4
-                out.append(g)
-                out.append(a)
-    elif mode == 'i24':
-         for i in data:
-             a = (i>>6) & 3
-             b = (i>>4) & 3
-             c = (i>>2) & 3
-             d = (a<<12) | (b<<8) | (c<<4) | (i&3)
-             d|= d<<2
-             out.extend(d.to_bytes(2, byteorder='big'))
-    elif mode == 'i28':
-         for i in data:
-             a = (i>>6) & 3
-             b = (i>>4) & 3
-             c = (i>>2) & 3
-             d = (a<<24) | (b<<16) | (c<<8) | (i&3)
-             d|= d<<4
-             d|= d<<8
-             out.extend(d.to_bytes(4, byteorder='big'))
-    else:
+    tables = _splittables.get(mode)
+    if tables is None:
         return data
+    w = len(tables)
+    data = bytes(data)
+    out = bytearray(len(data)*w)
+    for k, t in enumerate(tables):
+        out[k::w] = data.translate(t)
     return bytes(out)
 
 def _nibbler(v):
     return ((v>>4) | (v<<4)) & 0xFF
+_nibbletable = bytes(map(_nibbler, range(256)))
 def nibbleswap(data):
-    return bytes(i for i in map(_nibbler, data))
+    return bytes(data).translate(_nibbletable)
 
 def pal32to16(pal, swap=False):
     """Maps c32to16 to entire palette provided."""
@@ -256,16 +355,147 @@ def pal32to16(pal, swap=False):
         p.append((r<<11)|(g<<6)|(b<<1)|a)
     return struct.pack(">{:d}{}".format(len(p), 'h' if swap else 'H'), *p)
 
-def deinterlace(data, height):
-    from array import array
-    a = array("L", data)
-    l = len(a)//height
-    for j in range(1,height,2):
-        for k in range(l*j, l*(j+1), 2):
-            b = a[k]
-            a[k] = a[k+1]
-            a[k+1]= b
-    return a.tobytes()
+def deinterlace(data, height, inplace=False):
+    """Swaps each pair of 32bit words in odd rows, undoing TMEM interleaving.
+    Rows are swapped whole with a NumPy view or extended slices.
+    Returns a new bytearray, or with <inplace> data itself when it is a
+    writable buffer such as a bytearray, avoiding a copy."""
+    if inplace and not memoryview(data).readonly:
+        buf = data
+    else:
+        buf = bytearray(data)
+    l = len(buf) // height
+    # Bytes per row in whole pairs of words; any remainder is left as is.
+    n = l & ~7
+    if n == 0:
+        return buf
+    if numpy is not None:
+        a = numpy.frombuffer(buf, dtype=numpy.uint8, count=l*height).reshape(height, l)
+        v = a[1::2, :n].reshape(-1, n >> 3, 2, 4)
+        v[...] = v[:, :, ::-1].copy()
+        return buf
+    m = memoryview(buf)
+    for o in range(l, l*height, 2*l):
+        w = m[o:o+n].cast('I')
+        t = w[0::2].tobytes()
+        w[0::2] = w[1::2]
+        w[1::2] = memoryview(t).cast('I')
+    return buf
+
+def cleanpalette(pal):
+    """Merges duplicate colors of a 16bit palette.
+    Returns (palette, table): the palette with each color once, in order of
+    first use, and a bytes.translate table mapping old indices to new."""
+    seen = {}
+    t = bytearray(range(256))
+    for c in range(len(pal) >> 1):
+        t[c] = seen.setdefault(bytes(pal[2*c:2*c+2]), len(seen))
+    return b''.join(seen), bytes(t)
+
+_shr3table = bytes((i >> 3) for i in range(256))
+_shr7table = bytes((i >> 7) for i in range(256))
+
+def _boxcolor(box, counts):
+    """Count-weighted mean of a box of 5551 colors as an RGBA8 tuple."""
+    n = sum(counts[c] for c in box)
+    r, g, b, a = (sum(c[k]*counts[c] for c in box) for k in range(4))
+    r, g, b = ((v + n//2) // n for v in (r, g, b))
+    return ((r<<3)|(r>>2), (g<<3)|(g>>2), (b<<3)|(b>>2), 0xFF if 2*a >= n else 0)
+
+def quantize(rgba, colors=256, iterations=0):
+    """Reduces RGBA8 pixels to a palette of at most <colors> entries.
+    Colors are first cut to the 5551 precision of a 16bit palette, then
+    split by median cut along the widest channel of the box holding the
+    most pixels. <iterations> k-means passes (slow) then refine the palette.
+    Returns (palette, image): a list of RGBA8 tuples and a bytearray of one
+    palette index per pixel."""
+    from collections import Counter
+    data = bytes(rgba)
+    pixels = list(zip(data[0::4].translate(_shr3table), data[1::4].translate(_shr3table),
+                      data[2::4].translate(_shr3table), data[3::4].translate(_shr7table)))
+    counts = Counter(pixels)
+    # Alpha is one bit; scale it so opaque and clear split first.
+    scale = (1, 1, 1, 31)
+    def split(box):
+        """Returns (weight, channel) to split box along, weight 0 if it can't be."""
+        ranges = [(max(c[k] for c in box) - min(c[k] for c in box)) * scale[k] for k in range(4)]
+        k = ranges.index(max(ranges))
+        return (sum(counts[c] for c in box) * ranges[k], k)
+    boxes = [list(counts)]
+    splits = [split(boxes[0])]
+    while len(boxes) < colors:
+        weight, k = max(splits)
+        if weight == 0:
+            break
+        n = splits.index((weight, k))
+        box = sorted(boxes[n], key=lambda c: c[k])
+        half = sum(counts[c] for c in box) / 2
+        total = 0
+        for cut, c in enumerate(box[:-1], 1):
+            total += counts[c]
+            if total >= half:
+                break
+        boxes[n:n+1] = [box[:cut], box[cut:]]
+        splits[n:n+1] = [split(box[:cut]), split(box[cut:])]
+    pal = [_boxcolor(box, counts) for box in boxes]
+    lookup = {c: n for n, box in enumerate(boxes) for c in box}
+
+    for it in range(iterations):
+        centers = [(r>>3, g>>3, b>>3, (a>>7)*31) for r, g, b, a in pal]
+        members = [[] for _ in pal]
+        changed = False
+        for c in counts:
+            a = c[3]*31
+            d = [(c[0]-x)**2 + (c[1]-y)**2 + (c[2]-z)**2 + (a-w)**2 for x, y, z, w in centers]
+            n = d.index(min(d))
+            changed |= (n != lookup[c])
+            lookup[c] = n
+            members[n].append(c)
+        pal = [_boxcolor(m, counts) if m else p for m, p in zip(members, pal)]
+        if not changed:
+            break
+    return pal, bytearray(map(lookup.__getitem__, pixels))
+
+def _quantized(p, colors, **kwargs):
+    """Reads png.Reader p as RGBA8 and quantizes it for pngimp.
+    Returns (width, height, palette, rows) with rows of one index per pixel."""
+    w, h, i, m = p.asRGBA8()
+    pal, i = quantize(b''.join(i), colors, kwargs.get('iterations', 0))
+    return w, h, pal, (i[y*w:(y+1)*w] for y in range(h))
+
+# Number of decoded palettes kept; many textures share a few palettes.
+paletteCacheSize = 64
+
+@lru_cache(maxsize=paletteCacheSize)
+def _palette(pal, alpha, order, src):
+    p = unpackRGB(pal, 16, order, src)
+    return tuple(zip(*[iter(p)]*(4 if alpha else 3)))
+
+def palette(pal, alpha=True, order='rgba', src='rgba'):
+    """Returns a 16bit palette as a tuple of RGB(A) tuples for png.Writer.
+    Results are cached by content, so a palette shared by many images is
+    only decoded once."""
+    order = order.lower()
+    if not alpha:
+        order = order.replace('a','')
+    return _palette(bytes(pal), alpha, order, src.lower())
+
+def _pngfile(name):
+    """Returns a context manager for writing a png to name.
+    Filenames are opened and closed; file objects are used as is and left open."""
+    if hasattr(name, 'write'):
+        from contextlib import nullcontext
+        return nullcontext(name)
+    return open(name, 'wb')
+
+# Named png.Writer settings selected with img(..., profile=name).
+# pypng writes every row unfiltered and takes no zlib strategy, so a
+# profile only picks the zlib level; an explicit compress overrides it.
+exportProfiles = {
+    "preview":  {'compress': 1},
+    "balanced": {'compress': 6},
+    "archive":  {'compress': 9},
+    }
 
 def img(func, mode, **kwargs):
     """Converts images and binaries in the format specified by func.
@@ -283,18 +513,25 @@ def img(func, mode, **kwargs):
     img      (req) image filename or a bytes-like object
     pad      (opt) ci images: adds additional entries when palette
         has fewer than the maximum for that type
+    clean    (opt) ci images: merges duplicate palette colors
+    quantize (opt) ci images: reduces truecolor or larger palette images
+        to the type's maximum colors instead of raising TypeError
 
     Arguments for output types:
     img      (req) image as a bytes object
     pal      (req) palette as a bytes object for required types
     width    (req) width of image
-    name     (req) output filename, hopefully with .png extension
+    name     (opt) output filename, hopefully with .png extension,
+        or a writable file object such as io.BytesIO.
+        If omitted the png is returned as a bytes object.
     alpha    (opt) ci images: output with or without alpha channel
         default is True
     order    (opt) c/ci images: sets order of channels
         default is 'rgba'
     compress (opt) compression level
         default is 9
+    profile  (opt) name of an exportProfiles entry, e.g. "preview"
+        for fast exports or "archive" for the smallest files
 
     Format and depth use microcode typecodes:
         formats:
@@ -308,44 +545,122 @@ def img(func, mode, **kwargs):
             1   8 bit
             2   16bit
             3   32bit
+    Other formats and functions can be added with register().
     """
-    import sys
     if mode not in ('out', 'imp'):
         raise ValueError("Mode must be either 'out' or 'imp'.")
-##    f = sys.modules.get('N64img', None)
-##    if f is None:
-##        f = sys.modules.get('__main__')
-##    if f is None:
-##        raise ValueError("Unable to retrieve module name.")
-##    kwargs.update({'func':getattr(f, func+mode)})
-    kwargs.update({'func':globals().get(func+mode)})
-    return __funcredir(**kwargs)
-
-def __funcredir(**kwargs):
-    func = kwargs.get('func')
-    #TODO: this became necessary when the rest of it got fudged.
-    if 'cmd' in kwargs:
-        i = kwargs.get('cmd')
-    elif 'frmt' in kwargs and 'depth' in kwargs:
-        # This maps functions to handle standard types.
-        # As more support added, stick the functions here.
-        frmt = kwargs.get('frmt', -1)
+    codec = findcodec(func, mode, kwargs.pop('cmd', None), kwargs.pop('frmt', None), kwargs.pop('depth', None))
+    profile = kwargs.pop('profile', None)
+    if profile is not None:
+        if profile not in exportProfiles:
+            raise ValueError("Unknown profile {}. Use one of {}.".format(profile, ", ".join(exportProfiles)))
+        for k, v in exportProfiles[profile].items():
+            kwargs.setdefault(k, v)
+    if func == 'png' and png is None:
+        raise ImportError("img('png', ...) requires the pypng module.")
+    if mode == 'out' and kwargs.get('name') is None:
+        from io import BytesIO
+        f = BytesIO()
+        kwargs['name'] = f
+        codec(**kwargs)
+        return f.getvalue()
+    return codec(**kwargs)
+
+# Handlers by (func, mode, cmd), filled from the pngout and pngimp classes
+# at import and extended with register().
+codecs = {}
+# Microcode (format, depth) typecodes of the built-in cmd names.
+_typecodes = {
+    (0, 2): 'c16', (0, 3): 'c32',
+    (2, 0): 'ci4', (2, 1): 'ci8',
+    (3, 0): 'ia4', (3, 1): 'ia8', (3, 2): 'ia16',
+    (4, 0): 'i4',  (4, 1): 'i8',  (4, 2): 'i16',
+    }
+# (func, mode, format, depth) typecodes to cmd names; see img(). Kept per
+# func and mode so a registered codec can't redirect another's lookups.
+formatNames = {}
+_formatCodes = ('c', 'yuv', 'ci', 'ia', 'i')
+
+def register(func, mode, cmd, codec, frmt=None, depth=None):
+    """Makes codec the handler for img(func, mode, cmd=cmd, ...), and for
+    the format and depth typecodes frmt and depth if given.
+    codec is called with img's remaining keywords; for mode "out" these
+    include name, a filename or writable file object."""
+    if isinstance(frmt, str):
+        frmt = _formatCodes.index(frmt)
+    codecs[(func, mode, cmd)] = codec
+    if frmt is not None and depth is not None:
+        formatNames[(func, mode, frmt, depth)] = cmd
+
+def findcodec(func, mode, cmd=None, frmt=None, depth=None):
+    """Returns the handler for func and mode given either cmd, or frmt and
+    depth typecodes. Raises NotImplementedError if there is none."""
+    if cmd is None:
+        if frmt is None or depth is None:
+            raise ValueError("You must provide either 'cmd' or 'frmt'+'depth'.")
         if isinstance(frmt, str):
-            frmt = ('c', 'yuv', 'ci', 'ia', 'i').index(frmt)
-        depth= kwargs.get('depth',-1)
-        i = (('ni',  'ni',  'c16', 'c32'),
-             ('ni',  'ni',  'ni',  'ni'),
-             ('ci4', 'ci8', 'ni',  'ni'),
-             ('ia4', 'ia8', 'ia16','ni'),
-             ('i4',  'i8',  'i16', 'ni'),)[frmt][depth]
-    else:
-        raise ValueError("You must provide either 'cmd' or 'frmt'+'depth'.")
-    # Call function out of class or use NotImplemented.
-    try:
-        cmd = func().__getattribute__(i)
-    except AttributeError:
-        cmd = func.ni
-    return cmd(**kwargs)
+            frmt = _formatCodes.index(frmt)
+        cmd = formatNames.get((func, mode, frmt, depth))
+    codec = codecs.get((func, mode, cmd))
+    if codec is None:
+        raise NotImplementedError("No {}{} codec for {}.".format(func, mode, cmd))
+    return codec
+
+def _registerclass(func, mode, cls):
+    for cmd, v in vars(cls).items():
+        if isinstance(v, staticmethod) and cmd != 'ni':
+            register(func, mode, cmd, getattr(cls, cmd))
+    for (frmt, depth), cmd in _typecodes.items():
+        if (func, mode, cmd) in codecs:
+            formatNames[(func, mode, frmt, depth)] = cmd
+
+def _scanlines(img, rowsize, height, convert=None):
+    """Yields height rows of rowsize bytes from img, each passed through
+    convert if given, so only one converted row exists at a time."""
+    for o in range(0, rowsize*height, rowsize):
+        row = img[o:o+rowsize]
+        yield row if convert is None else convert(row)
+
+def _words(row):
+    """Big-endian 16bit values of row, as png.Writer wants for 16bit depths."""
+    from array import array
+    import sys
+    a = array("H", bytes(row))
+    if sys.byteorder == 'little':
+        a.byteswap()
+    return a
+
+def _swap32(data):
+    """Reverses the bytes of each 32bit word of data, padding it to a
+    whole word with zeros."""
+    data = bytes(data)
+    data += bytes(-len(data) & 3)
+    out = bytearray(len(data))
+    for k in range(4):
+        out[k::4] = data[3-k::4]
+    return out
+
+def _spread(v):
+    """Spreads the 4 bits of v to the even bits of a byte."""
+    return (v&1) | ((v&2)<<1) | ((v&4)<<2) | ((v&8)<<3)
+# Per plane and per output byte: translate tables putting the high or low
+# nibble of a GB plane byte into the low or high bit of four 2bit pixels.
+_gbtables = [[bytes(_spread(i >> s) << plane for i in range(256)) for s in (4, 0)] for plane in (0, 1)]
+
+def gbplanes(data):
+    """Merges GameBoy 2bpp tile rows, pairs of bytes holding the low and
+    high bitplane of 8 pixels, into 2bit packed pixels, first pixel high.
+    Each plane is spread with a bytes.translate table and the two are
+    combined with one big OR, so no Python code runs per pixel."""
+    data = bytes(data)
+    n = len(data) >> 1
+    lo, hi = data[0:2*n:2], data[1:2*n:2]
+    out = bytearray(2*n)
+    for k in (0, 1):
+        a = lo.translate(_gbtables[0][k])
+        b = hi.translate(_gbtables[1][k])
+        out[k::2] = (int.from_bytes(a, 'big') | int.from_bytes(b, 'big')).to_bytes(n, 'big')
+    return out
 
 # The class only exists as a wrapper here.
 class pngout:
@@ -353,7 +668,7 @@ class pngout:
     All have the same interface.  You must provide:
         img     image as a bytes-like object
         width   width of image as an int
-        name    output filename
+        name    output filename or writable file object
     Indexed types also require a palette:
         pal     palette as a bytes-like object
 
@@ -361,6 +676,9 @@ class pngout:
             'compress'   0-9 (default 9): compression level for output png
             'height'     default size//width: sets given image height
             'interlaced' default False: if True deinterlaces image, padding to block size as required
+            'inplace'    default False: if True deinterlaces a writable img (e.g. bytearray) in place
+    Rows are converted and handed to png.Writer one at a time, so memory
+    use beyond img grows with width rather than image size.
     Individual methods have additional optional keyword fields.
         Refer to the method docstrings for more details."""
 
@@ -371,18 +689,21 @@ class pngout:
             'src'        default 'rgba': sets the order of channels in source
             'alpha'      default True:   if False outputs flattened 24bit image
         """
-        import png
         alf = kwargs.get('alpha', True)
         der = kwargs.get('order', 'rgba').lower()
         if not alf:
             der = der.replace('a','')
         h = kwargs.get('height', (len(img)>>1)//width)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        o= unpackRGB(img, 16, der, kwargs.get('src', 'rgba').lower()) # bytearray of 32bit colors from 16bit, in rgba order
-        with open(name, 'wb') as f:
-            i= png.Writer(width=width, height=h, alpha=alf, compression=kwargs.get('compress', 9), interlace=kwargs.get('interlace', False), gamma=kwargs.get('gamma', None))
-            i.write_array(f, o)
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        src = kwargs.get('src', 'rgba').lower()
+        if numpy is None and width*h >= _rgb16TableMin:
+            # Build the lookup table once so every row uses it.
+            _rgb16Table(der, src)
+        o = _scanlines(img, width<<1, h, lambda r: unpackRGB(r, 16, der, src)) # rows of 32bit colors from 16bit, in rgba order
+        with _pngfile(name) as f:
+            i= png.Writer(width=width, height=h, greyscale=False, alpha=alf, compression=kwargs.get('compress', 9), interlace=kwargs.get('interlace', False), gamma=kwargs.get('gamma', None))
+            i.write(f, o)
 
     @staticmethod
     def c32(img, width, name, **kwargs):
@@ -391,18 +712,18 @@ class pngout:
             'src'       default 'rgba': sets the order of channels in source
             'alpha'     default True:   if False outputs flattened 24bit image
         """
-        import png
         alf = kwargs.get('alpha', True)
         der = kwargs.get('order', 'rgba').lower()
         if not alf:
             der = der.replace('a','')
         h = kwargs.get('height', (len(img)//width)>>2)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        o= unpackRGB(img, 32, der, kwargs.get('src', 'rgba').lower()) # bytearray of 32bit colors from 16bit, in rgba order
-        with open(name, 'wb') as f:
-            i= png.Writer(width=width, height=h, alpha=alf, compression=kwargs.get('compress', 9))
-            i.write_array(f, o)
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        src = kwargs.get('src', 'rgba').lower()
+        o = _scanlines(img, width<<2, h, lambda r: unpackRGB(r, 32, der, src)) # rows of 32bit colors in output order
+        with _pngfile(name) as f:
+            i= png.Writer(width=width, height=h, greyscale=False, alpha=alf, compression=kwargs.get('compress', 9))
+            i.write(f, o)
 
     @staticmethod
     def ci4(img, pal, width, name, **kwargs):
@@ -412,26 +733,16 @@ class pngout:
             'alpha'      default True: if False treats input as a 15bit image
             'nibbleswap' default False: swaps order of nibbles
         """
-        import png
-        alf = kwargs.get('alpha', True)
-        der = kwargs.get('order', 'rgba').lower()
-        if not alf:
-            der = der.replace('a','')
-        p = unpackRGB(pal, 16, der, kwargs.get('src', 'rgba').lower())
-        if alf:
-            p = zip(*[iter(p)]*4)
-        else:
-            p = zip(*[iter(p)]*3)
-##            p = zip(p[::4], p[1::4], p[2::4])
+        p = palette(pal, kwargs.get('alpha', True), kwargs.get('order', 'rgba'), kwargs.get('src', 'rgba'))
         if kwargs.get('nibbleswap', False):
             img = nibbleswap(img)
         w = (width+1)>>1
         h = kwargs.get('height', len(img) // w)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, bitdepth=4, palette=p, compression=kwargs.get('compress', 9))
-            i.write_packed(f, [img[i:i+w] for i in range(0,len(img),w)])
+            i.write_packed(f, _scanlines(img, w, h))
 
     @staticmethod
     def ci8(img, pal, width, name, **kwargs):
@@ -440,149 +751,125 @@ class pngout:
             'src'       default 'rgba': sets the order of channels in source
             'alpha'     default True: if False treats input as a 15bit image
         """
-        import png
-        alf = kwargs.get('alpha', True)
-        der = kwargs.get('order', 'rgba').lower()
-        if not alf:
-            der = der.replace('a','')
-        p= unpackRGB(pal, 16, der, kwargs.get('src', 'rgba').lower()) # bytearray of 32bit colors from 16bit, in rgba order
-        if alf:
-            p = zip(*[iter(p)]*4)
-        else:
-            p = zip(*[iter(p)]*3)
-##            p = zip(p[::4], p[1::4], p[2::4])
+        p = palette(pal, kwargs.get('alpha', True), kwargs.get('order', 'rgba'), kwargs.get('src', 'rgba'))
         h = kwargs.get('height', len(img)//width)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        with _pngfile(name) as f:
             i = png.Writer(width=width, height=h, bitdepth=8, palette=p, compression=kwargs.get('compress', 9))
-            i.write_array(f, img)
+            i.write(f, _scanlines(img, width, h))
 
     @staticmethod
     def ia4(img, width, name, **kwargs):
         """Optional keywords:
             'nibbleswap'    default False: swaps order of nibbles
         """
-        import png
         if kwargs.get('nibbleswap', False):
             img = nibbleswap(img)
         w = (width+1)>>1
         h = kwargs.get('height', len(img)//w)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        o = splitter(img, 'ia4') # bytearray of 8bit IA values
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        o = _scanlines(img, w, h, lambda r: splitter(r, 'ia4')) # rows of 8bit IA values
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, alpha=True, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_array(f, o)
+            i.write(f, o)
 
     @staticmethod
     def ia8(img, width, name, **kwargs):
         """Optional keywords:
             None
         """
-        import png
         h = kwargs.get('height', len(img)//width)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        o = splitter(img, 'ia8') # bytearray of 8bit IA values
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        o = _scanlines(img, width, h, lambda r: splitter(r, 'ia8')) # rows of 8bit IA values
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, alpha=True, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_array(f, o)
+            i.write(f, o)
 
     @staticmethod
     def ia16(img, width, name, **kwargs):
         """Optional keywords:
             None
         """
-        import png
         h = kwargs.get('height', (len(img)//width)>>1)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, alpha=True, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_array(f, img)
+            i.write(f, _scanlines(img, width<<1, h))
 
     @staticmethod
     def i1(img, width, name, **kwargs):
         """Optional keywords:
             'swap'      default False: 32bit byteswaps input
         """
-        import png
         # Do you need to byteswap words before using this?
-        w = (width+1)>>3
+        w = (width+7)>>3
         h = kwargs.get('height', len(img) // w)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
+            img = deinterlace(img, h, kwargs.get('inplace', False))
         if kwargs.get('swap', False):
-            from array import array
-            a = array("L", img+bytes(len(img)&3))
-            a.byteswap()
-            img = a.tobytes()
-        with open(name, 'wb') as f:
+            img = _swap32(img)
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, bitdepth=1, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_packed(f, [img[i:i+w] for i in range(0,len(img),w)])
+            i.write_packed(f, _scanlines(img, w, h))
 
     @staticmethod
     def i2(img, width, name, **kwargs):
         """Optional keywords:
             'swap'      default False: 32bit byteswaps input
         """
-        import png
         # Do you need to byteswap words before using this?
         if kwargs.get('swap', False):
-            from array import array
-            a = array("L", img+bytes(len(img)&3))
-            a.byteswap()
-            img = a.tobytes()
-        w = (width+1)>>2
+            img = _swap32(img)
+        w = (width+3)>>2
         h = kwargs.get('height', len(img) // w)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, bitdepth=2, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_packed(f, [img[i:i+w] for i in range(0,len(img),w)])
+            i.write_packed(f, _scanlines(img, w, h))
 
     @staticmethod
     def i4(img, width, name, **kwargs):
         """Optional keywords:
             'nibbleswap'    default False: swaps order of nibbles
         """
-        import png
         if kwargs.get('nibbleswap', False):
             img = nibbleswap(img)
         w = (width+1)>>1
         h = kwargs.get('height', len(img) // w)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, bitdepth=4, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_packed(f, [img[i:i+w] for i in range(0,len(img),w)])
+            i.write_packed(f, _scanlines(img, w, h))
 
     @staticmethod
     def i8(img, width, name, **kwargs):
         """Optional keywords:
             None
         """
-        import png
         h = kwargs.get('height', len(img)//width)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, bitdepth=8, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_array(f, img)
+            i.write(f, _scanlines(img, width, h))
 
     @staticmethod
     def i16(img, width, name, **kwargs):
         """Optional keywords:
             None
         """
-        import png
         h = kwargs.get('height',(len(img)//width)>>1)
         if kwargs.get('interlaced', False):
-            img = deinterlace(img, h)
-        with open(name, 'wb') as f:
+            img = deinterlace(img, h, kwargs.get('inplace', False))
+        with _pngfile(name) as f:
             i= png.Writer(width=width, height=h, bitdepth=16, greyscale=True, compression=kwargs.get('compress', 9))
-            i.write_array(f, img)
+            i.write(f, _scanlines(img, width<<1, h, _words))
 
     @staticmethod
     def GBi2(img, width, name, **kwargs):
@@ -591,18 +878,20 @@ class pngout:
             None
         """
         ##TODO: implement optional palette field
-        import png
-        o = []
-        for n in range(0,len(img),2):
-             i, j =img[n], img[n+1]
-             for x in range(8):
-                 o.append(((i&0x80)>0) | (((j&0x80)>0)<<1))
-                 i<<=1
-                 j<<=1;
-        h = kwargs.get('height', len(o)//width)
-        with open(name, 'wb') as f:
+        o = gbplanes(img)
+        h = kwargs.get('height', (len(o)<<2)//width)
+        if width & 3:
+            # Rows don't start on a byte, so write one value per pixel.
+            o = _repack([o], len(o), 1, 2, 8)
+            rows = _scanlines(o, width, h)
+        else:
+            rows = None
+        with _pngfile(name) as f:
              i= png.Writer(width=width, height=h, greyscale=True, alpha=False, bitdepth=2, compression=kwargs.get('compress', 9))
-             i.write_array(f, o)
+             if rows is None:
+                 i.write_packed(f, _scanlines(o, width>>2, h))
+             else:
+                 i.write(f, rows)
 
     @staticmethod
     def ni(**kwargs):
@@ -638,7 +927,6 @@ class pngimp():
         <img> may be either a filename (str), bytes, or bytearray object.
         Most .png formats should be compatible.
         """
-        import png
         # They test for bytes via isarray(), which throws an exception in 3.x.
         if isinstance(img, (bytes, bytearray)):
             p = png.Reader(bytes=img)
@@ -655,8 +943,10 @@ class pngimp():
         Input .png must be a paletted type and can not have more than 16 colors.
 
         Optional keywords:
-            'pad'      default False: adds additional entries when palette has fewer than 16 colors."""
-        import png
+            'pad'      default False: adds additional entries when palette has fewer than 16 colors.
+            'clean'    default False: merges duplicate palette colors.
+            'quantize' default False: reduces other images to 16 colors instead of failing.
+            'iterations' default 0: k-means passes refining a quantized palette."""
         from itertools import chain
         # They test for bytes via isarray(), which throws an exception in 3.x.
         if isinstance(img, (bytes, bytearray)):
@@ -665,43 +955,27 @@ class pngimp():
             p = png.Reader(img)
 
         p.preamble()
-        if not p.colormap:
+        if p.colormap and len(p.palette(alpha='force')) <= 16:
+            pal = p.palette(alpha='force')
+            w, h, i, m = _png_Reader_read_serial(p)
+            d = m.get('bitdepth',4)
+            if d not in (1, 2, 4, 8):
+                raise TypeError("Only paletted images with bitdepths 1, 2, 4, or 8 are currently supported.")
+            i = _repack(i, (w*d+7) >> 3, h, d, 4)
+        elif kwargs.get('quantize', False):
+            w, h, pal, i = _quantized(p, 16, **kwargs)
+            i = _repack(i, w, h, 8, 4)
+        elif not p.colormap:
             raise TypeError("Image must contain a palette.")
-        pal = p.palette(alpha='force')
-        npal = len(pal)
-        if npal > 16:
+        else:
             raise TypeError("Image must have no more than 16 colors in its palette.")
 
-        w, h, i, m = _png_Reader_read_serial(p)
-        d = m.get('bitdepth',4)
-        if d not in (1, 2, 4, 8):
-            raise TypeError("Only paletted images with bitdepths 1, 2, 4, or 8 are currently supported.")
-        i = b''.join(i)
-        if d != 4:
-            img = bytearray()
-            if d == 1:
-                for j in i:
-                    for k in range(4):
-                        x = (j & 0x80) >> 3
-                        y = (j & 0x40) >> 6
-                        img.append(x | y)
-                        j<<=2
-            elif d == 2:
-                for j in i:
-                    v = (j & 0xCC) >> 2
-                    j &= 0x33
-                    img.append((v & 0x30) | j>>4)
-                    img.append(((v << 4) & 0x30) | (j & 7))
-            elif d == 8:
-                for j in range(0, len(i), 2):
-                    img.append((j[0]<<4) | j[1])
-            i = bytes(img)
-
         pal = pal32to16(list(chain(*pal)))
         if kwargs.get('clean', False):
-            # TODO: create a translation table for image
-            # mapping later instances of identical colors to previous ones.  Byteorder doesn't matter.
-            pass
+            # Map later instances of identical colors to the first one, for
+            # both nibbles of each byte.  Byteorder doesn't matter.
+            pal, t = cleanpalette(pal)
+            i = i.translate(bytes((t[j>>4]<<4) | t[j&15] for j in range(256)))
         if kwargs.get('pad', False):
             pal = b''.join((pal, bytes(32-len(pal))))
 
@@ -714,8 +988,10 @@ class pngimp():
         Input .png must be a paletted type and can not have more than 256 colors.
 
         Optional keywords:
-            'pad'      default False: adds additional entries when palette has fewer than 256 colors."""
-        import png
+            'pad'      default False: adds additional entries when palette has fewer than 256 colors.
+            'clean'    default False: merges duplicate palette colors.
+            'quantize' default False: reduces other images to 256 colors instead of failing.
+            'iterations' default 0: k-means passes refining a quantized palette."""
         from itertools import chain
         # They test for bytes via isarray(), which throws an exception in 3.x.
         if isinstance(img, (bytes, bytearray)):
@@ -724,42 +1000,24 @@ class pngimp():
             p = png.Reader(img)
 
         p.preamble()
-        if not p.colormap:
+        if p.colormap:
+            pal = p.palette(alpha='force')
+            w, h, i, m = _png_Reader_read_serial(p)
+            d = m.get('bitdepth',8)
+            if d not in (1, 2, 4, 8):
+                raise TypeError("Only paletted images with bitdepths 1, 2, 4, or 8 are currently supported.")
+            i = _repack(i, (w*d+7) >> 3, h, d, 8)
+        elif kwargs.get('quantize', False):
+            w, h, pal, i = _quantized(p, 256, **kwargs)
+            i = _repack(i, w, h, 8, 8)
+        else:
             raise TypeError("Image must contain a palette.")
-        pal = p.palette(alpha='force')
-        npal = len(pal)
-        if npal > 256:
-            raise TypeError("Image must have no more than 256 colors in its palette.")
-
-        w, h, i, m = _png_Reader_read_serial(p)
-        d = m.get('bitdepth',8)
-        if d not in (1, 2, 4, 8):
-            raise TypeError("Only paletted images with bitdepths 1, 2, 4, or 8 are currently supported.")
-        i = b''.join(i)
-        if d != 8:
-            out = bytearray()
-            m = (1 << d) - 1
-            for j in i:
-                for k in range(8, 0, -d):
-                    k-=d
-                    out.append((j>>k) & m)
-            i = bytes(out)
 
         pal = pal32to16(list(chain(*pal)))
         if kwargs.get('clean', False):
-            # Experimental: create a translation table for image
-            # mapping later instances of identical colors to previous ones.  Byteorder doesn't matter.
-            from array import array
-            a = array("H", pal)
-            p = array("H")
-            t = bytearray(range(256))
-            for c,j in enumerate(a):
-                if j in p:
-                    t[c] = p.index(j)
-                else:
-                    t[c] = len(p)
-                    p.append(j)
-            pal = p.tobytes()
+            # Map later instances of identical colors to the first one.
+            # Byteorder doesn't matter.
+            pal, t = cleanpalette(pal)
             i = i.translate(t)
         if kwargs.get('pad', False):
             pal = b''.join((pal, bytes(512-len(pal))))
@@ -772,7 +1030,6 @@ class pngimp():
         <img> may be either a filename (str), bytes, or bytearray object.
         Input .png must be a greyscale type.
         """
-        import png
         # They test for bytes via isarray(), which throws an exception in 3.x.
         if isinstance(img, (bytes, bytearray)):
             p = png.Reader(bytes=img)
@@ -787,26 +1044,7 @@ class pngimp():
             raise TypeError("Only greyscale images with bitdepths 1, 2, 4, or 8 are currently supported.")
 
         w, h, i, m = _png_Reader_read_serial(p)
-        i = b''.join(i)
-        if d != 4:
-            img = bytearray()
-            if d == 1:
-                for j in i:
-                    for k in range(4):
-                        x = (j & 0x80) >> 3
-                        y = (j & 0x40) >> 6
-                        img.append(x | y)
-                        j<<=2
-            elif d == 2:
-                for j in i:
-                    v = (j & 0xCC) >> 2
-                    j &= 0x33
-                    img.append((v & 0x30) | j>>4)
-                    img.append(((v << 4) & 0x30) | (j & 7))
-            elif d == 8:
-                for j in range(0, len(i), 2):
-                    img.append((j[0]<<4) | j[1])
-            i = bytes(img)
+        i = _repack(i, (w*d+7) >> 3, h, d, 4, intensity=True)
 
         return export_pattern._replace(width=w, height=h, image=i)
 
@@ -816,7 +1054,6 @@ class pngimp():
         <img> may be either a filename (str), bytes, or bytearray object.
         Input .png must be a greyscale type.
         """
-        import png
         # They test for bytes via isarray(), which throws an exception in 3.x.
         if isinstance(img, (bytes, bytearray)):
             p = png.Reader(bytes=img)
@@ -831,15 +1068,7 @@ class pngimp():
             raise TypeError("Only greyscale images with bitdepths 1, 2, 4, or 8 are currently supported.")
 
         w, h, i, m = _png_Reader_read_serial(p)
-        i = b''.join(i)
-        if d != 8:
-            out = bytearray()
-            m = (1 << d) - 1
-            for j in i:
-                for k in range(8, 0, -d):
-                    k-=d
-                    out.append((j>>k) & m)
-            i = bytes(out)
+        i = _repack(i, (w*d+7) >> 3, h, d, 8)
 
         return export_pattern._replace(width=w, height=h, image=i)
 
@@ -853,40 +1082,39 @@ def _png_Reader_read_serial(src, lenient=False, deinterlace=False):
     Returns (width, height, image, meta).
     Image is a generator outputing individual scanlines;
         you can use b''.join(image) to get a proper bytes object.
+    IDAT data is decompressed as the scanlines are consumed, so unless
+    deinterlacing the whole image is never held in memory.
 
     This could be monkeypatched in, but meh."""
-    import png
     import warnings
     import zlib
 
     src.preamble(lenient=lenient)
-    raw = []
-    d = zlib.decompressobj()
-    r = None
-    while True:
-        try:
-            kind, data = src.chunk(lenient=lenient)
-        except ValueError as e:
-            raise png.ChunkError(e.args[0])
-        # Seems different pypng versions expect bytes or str.
-        if kind in ('IEND', b'IEND'):
-            # http://www.w3.org/TR/PNG/#11IEND
-            break
-        if kind not in ('IDAT', b'IDAT'):
-            continue
-        # kind == b'IDAT'
-        # http://www.w3.org/TR/PNG/#11IDAT
-        if src.colormap and not src.plte:
-            warnings.warn("PLTE chunk is required before IDAT chunk")
-        if r is None:
-            r = bytearray(d.decompress(data))
-        else:
-            r.extend(d.decompress(data))
-        while d.unconsumed_tail:
-            r.extend(d.decompress(d.unconsumed_tail))
-        if d.eof:
-            raw.append(r)
-            r = None
+
+    def idat():
+        d = zlib.decompressobj()
+        while True:
+            try:
+                kind, data = src.chunk(lenient=lenient)
+            except ValueError as e:
+                raise png.ChunkError(e.args[0])
+            # Seems different pypng versions expect bytes or str.
+            if kind in ('IEND', b'IEND'):
+                # http://www.w3.org/TR/PNG/#11IEND
+                break
+            if kind not in ('IDAT', b'IDAT'):
+                continue
+            # kind == b'IDAT'
+            # http://www.w3.org/TR/PNG/#11IDAT
+            if src.colormap and not src.plte:
+                warnings.warn("PLTE chunk is required before IDAT chunk")
+            if d.eof:
+                continue
+            r = d.decompress(data)
+            if r:
+                yield r
+            while d.unconsumed_tail:
+                yield d.decompress(d.unconsumed_tail)
 
     meta = dict()
     for attr in 'greyscale alpha planes bitdepth interlace'.split():
@@ -898,7 +1126,78 @@ def _png_Reader_read_serial(src, lenient=False, deinterlace=False):
             meta[attr] = a
     if src.plte:
         meta['palette'] = src.palette()
-    return src.width, src.height, src.deinterlace(raw) if deinterlace else src.iterstraight(raw), meta
+    if deinterlace:
+        rows = src.deinterlace(bytearray(b''.join(idat())))
+    else:
+        rows = src.iterstraight(idat())
+    return src.width, src.height, rows, meta
+
+# Translate tables turning a byte of png pixels of a given depth into output
+# bytes of 4 or 8 bits per pixel, one table per output byte.
+_rowtables = {}
+
+def _rowtable(depth, outdepth):
+    t = _rowtables.get((depth, outdepth))
+    if t is None:
+        mask = (1 << depth) - 1
+        n = 8 // depth
+        px = lambda b, i: (b >> (8 - depth*(i+1))) & mask
+        if outdepth == 8:
+            t = [bytes(px(b, j) for b in range(256)) for j in range(n)]
+        else:
+            t = [bytes((px(b, 2*j) << 4) | px(b, 2*j+1) for b in range(256)) for j in range(n//2)]
+        _rowtables[(depth, outdepth)] = t
+    return t
+
+_shl4table = bytes(((i << 4) & 0xFF) for i in range(256))
+_lowtable = bytes((i & 0x0F) for i in range(256))
+_hightable = bytes((i & 0xF0) for i in range(256))
+_shr4table = bytes((i >> 4) for i in range(256))
+
+def _packnibbles(row, intensity=False):
+    """Packs pairs of 8bit pixels into one byte each, first pixel high.
+    Keeps the low nibble of each pixel, or the high one for intensities."""
+    if intensity:
+        hi = row[0::2].translate(_hightable)
+        lo = row[1::2].translate(_shr4table)
+    else:
+        hi = row[0::2].translate(_shl4table)
+        lo = row[1::2].translate(_lowtable)
+    n = len(hi)
+    # Nibbles never overlap, so one big OR combines the whole row.
+    return (int.from_bytes(hi, 'big') | int.from_bytes(lo.ljust(n, b'\0'), 'big')).to_bytes(n, 'big')
+
+def _repack(rows, rowsize, height, depth, outdepth, intensity=False):
+    """Repacks png scanlines of rowsize bytes at depth bits per pixel
+    (1, 2, 4, or 8) to outdepth (4 or 8) bits per pixel.
+    Rows are written into one preallocated bytearray as they arrive.
+    See _packnibbles for intensity when going from 8 to 4 bits."""
+    tables = None
+    if depth == outdepth:
+        outrow = rowsize
+    elif depth == 8:
+        outrow = (rowsize+1) >> 1
+    else:
+        tables = _rowtable(depth, outdepth)
+        outrow = rowsize * len(tables)
+    k = len(tables) if tables else 1
+    out = bytearray(outrow * height)
+    o = 0
+    for row in rows:
+        if not isinstance(row, (bytes, bytearray)):
+            row = bytes(row)
+        if tables:
+            for j, t in enumerate(tables):
+                out[o+j:o+outrow:k] = row.translate(t)
+        elif depth == outdepth:
+            out[o:o+outrow] = row
+        else:
+            out[o:o+outrow] = _packnibbles(row, intensity)
+        o += outrow
+    return out
+
+_registerclass('png', 'out', pngout)
+_registerclass('png', 'imp', pngimp)
 
 def main():
     pass
@@ -4,9 +4,13 @@
 
 from tkinter import *
 import tkinter.filedialog as filedialog
+import tkinter.ttk as ttk
 from PIL import Image, ImageTk
-import  os, logging
-import frontend, lzyf
+import  os, io, logging, queue, threading
+import frontend, batch, cache
+
+class Cancelled(Exception):
+    pass
 
 class Application(Frame):
     def __init__(self, master=None):
@@ -14,15 +18,29 @@ class Application(Frame):
         self.master = master
         self.appName = "Application Utility"
         self.infilename = ''
-        self.tmpfilename = "game_over.256x32.png"
+        self.pngdata = None
+        self.cache = cache.AssetCache()
         self.log = logging.getLogger(self.appName)
+        # Long operations run one at a time on a worker thread. It reports
+        # back through self.events, which the Tk thread polls with after().
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+        self.pending = 0
+        self.current = None
+        threading.Thread(target=self.work, daemon=True).start()
         self.prepare()
+        self.after(100, self.poll)
     def prepare(self):
         self.master.title(self.appName)
         self.pack(fill=BOTH, expand=1)
         quitButton = Button(self, text="Decode",
             command=self.image_decode)
         quitButton.place(x=0, y=0)
+        self.cancelButton = Button(self, text="Cancel", command=self.cancel, state=DISABLED)
+        self.cancelButton.place(x=80, y=0)
+        self.progress = ttk.Progressbar(self, length=200, maximum=1.0)
+        self.progress.place(x=160, y=4)
         self.textLabel = Label(self, text="Ready!")
         self.textLabel.place(x=0, y=50)
         self.imgLabel = Label(self, image=None)
@@ -46,31 +64,102 @@ class Application(Frame):
         toolsMenu.add_command(label="Compress Yay0 file...", command=self.compress_yay0)
         toolsMenu.add_command(label="Compress LZYF file...", command=self.compress_lzyf)
         mainMenu.add_cascade(label="Tools", menu=toolsMenu)
-    def image_decode(self):
-        self.tmpfilename = ''
-        ext = frontend.parseFilename(self.infilename)[-1]
-        # If file extension ends in y it's pixel data only with a
-        # separate palette file containing palette information.
-        if 'y' == ext[-1]:
-            self.tmpfilename = frontend.processMultiFileImage(self.infilename)
+    def submit(self, title, func, done, cancellable=True):
+        """
+        Queues func(progress) for the worker thread. done(result) is then
+        called on the Tk thread unless func fails or is cancelled.
+        Jobs whose func never calls progress can't be cancelled and should
+        pass cancellable=False, which disables Cancel while they run.
+        """
+        self.pending += 1
+        self.jobs.put((title, func, done, cancellable))
+        self.show_status()
+    def work(self):
+        while True:
+            title, func, done, cancellable = self.jobs.get()
+            self.cancelled.clear()
+            self.events.put(("start", title, cancellable))
+            def progress(pos, size):
+                if self.cancelled.is_set():
+                    raise Cancelled()
+                self.events.put(("progress", title, (pos / size) if size else 1.0))
+            try:
+                self.events.put(("done", title, (done, func(progress))))
+            except Cancelled:
+                self.events.put(("cancelled", title, None))
+            except Exception as e:
+                self.log.exception("Failed: {}".format(title))
+                self.events.put(("failed", title, e))
+    def poll(self):
+        try:
+            while True:
+                kind, title, value = self.events.get_nowait()
+                if kind == "start":
+                    self.current = title
+                    self.progress['value'] = 0
+                    self.cancelButton['state'] = NORMAL if value else DISABLED
+                elif kind == "progress":
+                    self.progress['value'] = value
+                else:
+                    self.pending -= 1
+                    self.current = None
+                    self.progress['value'] = 0
+                    self.cancelButton['state'] = DISABLED
+                    if kind == "done":
+                        done, result = value
+                        try:
+                            done(result)
+                        except Exception as e:
+                            self.log.exception("Failed: {}".format(title))
+                            self.textLabel['text'] = "{} failed: {}".format(title, e)
+                    elif kind == "cancelled":
+                        self.textLabel['text'] = "Cancelled: " + title
+                    else:
+                        self.textLabel['text'] = "{} failed: {}".format(title, value)
+                self.show_status()
+        except queue.Empty:
+            pass
+        finally:
+            self.after(100, self.poll)
+    def show_status(self):
+        if self.current:
+            self.master.title("{} - {} ({} queued)".format(self.appName, self.current, self.pending-1))
         else:
-            self.tmpfilename = frontend.processSingleFileImage(self.infilename)
-        if(self.tmpfilename == ''):
-            self.textLabel['text'] = "Image Decode Failed!"
-        else:
-            self.textLabel['text'] = "Image Decoded Successfully!"
+            self.master.title(self.appName)
+    def cancel(self):
+        self.cancelled.set()
+    def image_decode(self):
+        # Decoded PNG is kept in memory until shown, and cached so
+        # reopening the same texture is instant.
+        fn = self.infilename
+        def decoded(pngdata):
+            self.pngdata = pngdata
+            if not self.pngdata:
+                self.textLabel['text'] = "Image Decode Failed!"
+            else:
+                self.textLabel['text'] = "Image Decoded Successfully!"
+        self.textLabel['text'] = "Decoding " + fn
+        self.submit("Decode " + os.path.basename(fn),
+                    lambda progress: frontend.pngImage(fn, self.cache, "preview"), decoded, False)
     def open_file(self):
         self.infilename = filedialog.askopenfilename()
         self.log.info(("Selected: %s" % self.infilename))
         self.textLabel['text'] = "Opened:"+self.infilename
     def save_file(self):
-        self.outfilename = frontend.getPngFileName(self.infilename)
-        os.rename(self.tmpfilename, self.outfilename)
-        self.textLabel['text'] = "Saved:" + self.outfilename
+        # The displayed PNG is a fast preview; saving exports it again at
+        # the smallest size.
+        fn = self.infilename
+        self.outfilename = frontend.getPngFileName(fn)
+        def write(pngdata, outfilename=self.outfilename):
+            with open(outfilename, "wb") as f:
+                f.write(pngdata)
+            self.textLabel['text'] = "Saved:" + outfilename
+        self.submit("Save " + os.path.basename(self.outfilename),
+                    lambda progress: frontend.pngImage(fn, self.cache, "archive"), write, False)
     def app_exit(self):
         exit()
     def show_image(self):
-        load = Image.open(self.tmpfilename) # TODO: Modify this !!!
+        load = Image.open(io.BytesIO(self.pngdata))
         render = ImageTk.PhotoImage(load)
         # self.imgLabel = Label(self, image=render)
         self.imgLabel.configure(image=render)
@@ -80,23 +169,40 @@ class Application(Frame):
     def show_text(self):
         self.textLabel['text'] = "Image Displayed!"
     def compress_yay0(self):
-        self.textLabel['text'] = "Not Yet Implemented!"
+        self.compress_files("yay0")
     def compress_lzyf(self):
+        self.compress_files("lzyf")
+    def compress_files(self, fmt):
         file_types = [("Binary File","*.bin"),("All Files","*")]
-        f_in = filedialog.askopenfile(master=self, mode="rb",title="Open File",filetypes=file_types)
-        self.textLabel.configure(text="Compressing... please wait!")
-        self.update()
-        if f_in:
-            out = lzyf.create_lzyf(f_in.read())
-            file_types = [("LZYF File","*.lzyf"),("Binary File","*.bin"),("All Files","*")]
-            n = file_types[0][1].replace('*', os.path.splitext(f_in.name)[0], 1)
-            print("Initial file {}".format(n))
-            f_out = filedialog.asksaveasfile(mode="wb", initialfile=n, title="Save As...", filetypes=file_types)
-            if f_out != None:
+        names = filedialog.askopenfilenames(master=self, title="Open File",filetypes=file_types)
+        if not names:
+            self.textLabel['text'] = "Aborted!"
+            return
+        for fn in names:
+            self.submit("Compress " + os.path.basename(fn),
+                        lambda progress, fn=fn: self.compress_file(fn, fmt, progress),
+                        lambda result, fn=fn: self.save_compressed(fn, fmt, result))
+        self.textLabel['text'] = "Compressing... {} file(s) queued".format(len(names))
+    def compress_file(self, fn, fmt, progress):
+        with open(fn, "rb") as f:
+            data = f.read()
+        return (len(data),) + batch.compressData(data, fmt, verify=True, progress=progress)
+    def save_compressed(self, fn, fmt, result):
+        size, out, seconds, verified = result
+        ratio = (100.0 * len(out) / size) if size else 0.0
+        summary = "{} -> {} bytes ({:.1f}%) in {:.2f}s".format(size, len(out), ratio, seconds)
+        if not verified:
+            self.textLabel['text'] = "Verify failed for {}: {}".format(fn, summary)
+            return
+        suffix = batch.formats[fmt][1]
+        file_types = [(fmt.upper()+" File","*"+suffix),("Binary File","*.bin"),("All Files","*")]
+        n = file_types[0][1].replace('*', os.path.splitext(fn)[0], 1)
+        self.log.debug("Initial file {}".format(n))
+        f_out = filedialog.asksaveasfile(mode="wb", initialfile=n, title="Save As...", filetypes=file_types)
+        if f_out != None:
+            with f_out:
                 f_out.write(out)
-                self.textLabel['text'] = "Compressed {} to {}".format(f_in.name, f_out.name)
-            else:
-                self.textLabel['text'] = "Aborted!"
+            self.textLabel['text'] = "Compressed {} to {}\n{}, verified".format(fn, f_out.name, summary)
         else:
             self.textLabel['text'] = "Aborted!"
 
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Batch compression of many files to Yay0 or LZYF using a process pool.
+
+import os, time, logging, argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import yay0, lzyf
+
+log = logging.getLogger("batch")
+
+# Encoder and output file suffix for each supported format.
+formats = {"yay0": (yay0.yay0Enc, ".yay0"), "lzyf": (lzyf.create_lzyf, ".lzyf")}
+decoders = {"yay0": yay0.yay0Dec, "lzyf": lzyf.extract_lzyf}
+
+# verified is None unless the output was checked by decoding it again.
+BatchResult = namedtuple("BatchResult", ['name', 'outname', 'size', 'packed', 'seconds', 'verified'], defaults=(None,))
+
+def listFiles(paths):
+    """
+    Expands paths into a list of (path, relative name) pairs. Directories
+    are walked recursively in sorted order; files are taken as given.
+    """
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, names in os.walk(p):
+                dirs.sort()
+                for n in sorted(names):
+                    fn = os.path.join(root, n)
+                    files.append((fn, os.path.relpath(fn, p)))
+        else:
+            files.append((p, os.path.basename(p)))
+    return files
+
+def compressData(data, fmt="yay0", verify=False, **options):
+    """
+    Compresses data with the encoder for fmt, passing on options.
+    Returns (output, seconds taken, verified) where verified tells whether
+    decoding the output gives data back, or is None if verify is False.
+    """
+    encode = formats[fmt][0]
+    t = time.perf_counter()
+    out = encode(data, **options)
+    t = time.perf_counter() - t
+    verified = (decoders[fmt](out) == data) if verify else None
+    return (out, t, verified)
+
+def compressFile(job):
+    """
+    Compresses one file and writes the result. job is a tuple of
+    (path, outname, fmt, options) so it can be sent to a worker process.
+    Returns a BatchResult.
+    """
+    fn, outname, fmt, options = job
+    with open(fn, "rb") as f:
+        data = f.read()
+    out, t, verified = compressData(data, fmt, **options)
+    d = os.path.dirname(outname)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(outname, "wb") as f:
+        f.write(out)
+    return BatchResult(fn, outname, len(data), len(out), t, verified)
+
+def compressFiles(paths, fmt="yay0", outdir=None, workers=None, **options):
+    """
+    Compresses every file in paths (files or directories) with the encoder
+    for fmt, spreading the files over workers processes.
+    Output goes next to each input, or under outdir keeping the layout
+    below any directory given, with the format's suffix appended.
+    Files that already have that suffix are skipped.
+    Remaining keywords are passed to compressData, i.e. verify or encoder
+    options such as depth or optimal for yay0.
+    Returns a list of BatchResult in the same order as the input files.
+    workers=1 compresses in this process.
+    """
+    if fmt not in formats:
+        raise ValueError("Unknown format: {}. Use one of {}.".format(fmt, ", ".join(formats)))
+    suffix = formats[fmt][1]
+    jobs = []
+    for fn, rel in listFiles(paths):
+        # Earlier outputs sit next to their inputs; don't compress them again.
+        if fn.endswith(suffix):
+            log.info("Skipping {}: already {}".format(fn, fmt))
+            continue
+        if outdir is None:
+            outname = fn + suffix
+        else:
+            outname = os.path.join(outdir, rel + suffix)
+        jobs.append((fn, outname, fmt, options))
+    if workers == 1:
+        return [compressFile(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(compressFile, jobs))
+
+def formatResult(r):
+    ratio = (100.0 * r.packed / r.size) if r.size else 0.0
+    s = "{}: {} -> {} bytes ({:.1f}%) in {:.3f}s".format(r.name, r.size, r.packed, ratio, r.seconds)
+    if r.verified is not None:
+        s += ", verified" if r.verified else ", VERIFY FAILED"
+    return s
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress files to Yay0 or LZYF in parallel.")
+    parser.add_argument("paths", nargs="+", help="files or directories to compress")
+    parser.add_argument("-f", "--format", choices=sorted(formats), default="yay0")
+    parser.add_argument("-o", "--outdir", default=None, help="output directory (default: next to input)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("-d", "--depth", default=None, help="yay0 match finder depth: {} or a number".format(", ".join(yay0.matchDepths)))
+    parser.add_argument("--optimal", action="store_true", help="use the yay0 optimal parse")
+    parser.add_argument("--verify", action="store_true", help="decode each output and compare with the input")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARN)
+
+    options = {"verify": args.verify}
+    if args.format == "yay0":
+        if args.depth is not None:
+            options["depth"] = args.depth if args.depth in yay0.matchDepths else int(args.depth)
+        options["optimal"] = args.optimal
+    t = time.perf_counter()
+    results = compressFiles(args.paths, args.format, args.outdir, args.workers, **options)
+    t = time.perf_counter() - t
+    for r in results:
+        print(formatResult(r))
+    size = sum(r.size for r in results)
+    packed = sum(r.packed for r in results)
+    print("{} files: {} -> {} bytes in {:.2f}s ({:.2f}s compressing)".format(
+        len(results), size, packed, t, sum(r.seconds for r in results)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# Persistent cache of decoded assets with a small in-memory layer in front.
+
+import os, hashlib, logging
+from collections import OrderedDict
+
+log = logging.getLogger("cache")
+
+# Bump when decoder or converter output changes to invalidate old entries.
+cacheVersion = 1
+
+def defaultDirectory():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "fantastic-spoon")
+
+class AssetCache:
+    """
+    Maps keys (see key) to bytes, stored as files in directory.
+    The disk cache is capped at maxSize bytes, evicting least recently used
+    entries first; the last memoryItems entries used are also kept in memory.
+    """
+    suffix = ".bin"
+
+    def __init__(self, directory=None, maxSize=256<<20, memoryItems=16):
+        self.directory = directory or defaultDirectory()
+        self.maxSize = maxSize
+        self.memoryItems = memoryItems
+        self.memory = OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+        self.size = sum(size for name, mtime, size in self.entries())
+
+    @staticmethod
+    def key(data, *options):
+        """
+        Returns the key for the input bytes data converted with options,
+        which must have a stable repr.
+        """
+        h = hashlib.sha1(data)
+        h.update(repr((cacheVersion,) + options).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def entries(self):
+        """Returns (name, mtime, size) of every entry on disk."""
+        out = []
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith(self.suffix) and e.is_file():
+                    st = e.stat()
+                    out.append((e.path, st.st_mtime, st.st_size))
+        return out
+
+    def remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memoryItems:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the bytes stored for key, or None."""
+        fn = self.path(key)
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            # mtime records the last use for eviction, including memory hits.
+            try:
+                os.utime(fn)
+            except OSError:
+                pass
+            return value
+        try:
+            with open(fn, "rb") as f:
+                value = f.read()
+            os.utime(fn)
+        except OSError:
+            return None
+        self.remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """Stores value for key and returns it."""
+        self.remember(key, value)
+        fn = self.path(key)
+        tmp = fn + ".tmp"
+        try:
+            old = os.path.getsize(fn) if os.path.exists(fn) else 0
+            with open(tmp, "wb") as f:
+                f.write(value)
+            os.replace(tmp, fn)
+        except OSError as e:
+            log.warning("Unable to cache {}: {}".format(key, e))
+            return value
+        self.size += len(value) - old
+        if self.size > self.maxSize:
+            self.evict()
+        return value
+
+    def evict(self):
+        """Removes least recently used entries until within maxSize."""
+        entries = sorted(self.entries(), key=lambda e: e[1])
+        self.size = sum(e[2] for e in entries)
+        for name, mtime, size in entries:
+            if self.size <= self.maxSize:
+                break
+            try:
+                os.remove(name)
+            except OSError:
+                continue
+            self.size -= size
+            log.debug("Evicted {}".format(name))
+
+    def getOrCreate(self, key, create):
+        """Returns the value for key, calling create() to make it if missing."""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, create())
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        for name, mtime, size in self.entries():
+            os.remove(name)
+        self.size = 0
@@ -1,13 +1,18 @@
 # A frontend for yay0 decoder
 
-import os, tempfile, logging
-import yay0, N64img
+import os, time, json, hashlib, tempfile, logging, argparse
+from collections import namedtuple
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import yay0, N64img, batch
 
 paletteFormats = [ "ci4", "ci8"]
 paletteSizes = {"ci8":512, "ci4":32}
 #TODO: Extend with other support formats with palette.
 log = logging.getLogger("frontend")
 
+ConvertResult = namedtuple("ConvertResult", ['name', 'outname', 'size', 'packed', 'seconds'])
+
 def parseFilename(fileName):
     # Ignore any leading directory paths
     fileName = os.path.basename(fileName)
@@ -32,7 +37,23 @@ def getPngFileName(fn):
     (title, dim, w, h, ext) = parseFilename(fn)
     return title+"."+dim+".png"
 
-def processSingleFileImage(fn):
+@lru_cache(maxsize=N64img.paletteCacheSize)
+def _readPalette(pfn, mtime):
+    with open(pfn, "rb") as palFile:
+        return palFile.read()
+
+def readPalette(pfn):
+    """
+    Returns the contents of palette file pfn, reusing an earlier read while
+    the file's mtime is unchanged.
+    """
+    return _readPalette(os.path.abspath(pfn), os.stat(pfn).st_mtime_ns)
+
+def readSingleFileImage(fn):
+    """
+    Reads an image file with any palette at its start.
+    Returns (ext, imagedata, paldata, width, height) ready for N64img.img.
+    """
     with open(fn, "rb") as imageFile:
         imagedata = imageFile.read()
 
@@ -48,15 +69,13 @@ def processSingleFileImage(fn):
     if(b"Yay0" == imagedata[:0x04]):
         log.info ("Yay!!! Found yay0")
         imagedata = yay0.yay0Dec(imagedata)
+    return (ext, imagedata, paldata, w, h)
 
-    # Convert to PNG
-    fd,tmpFilePath = tempfile.mkstemp()
-    os.close(fd)
-    N64img.img('png', 'out', cmd=ext, img=imagedata, pal=paldata,
-               width=w, height=h, name=tmpFilePath)
-    return tmpFilePath
-
-def processMultiFileImage(fn):
+def readMultiFileImage(fn):
+    """
+    Reads an image file whose palette, if any, is in a separate .pal file.
+    Returns (ext, imagedata, paldata, width, height) ready for N64img.img.
+    """
     with open(fn, "rb") as imageFile:
         imagedata = imageFile.read()
 
@@ -72,23 +91,225 @@ def processMultiFileImage(fn):
     if(ext in paletteFormats):
         pfn = getPaletteFileName(fn)
         log.info(("Opening palette file %s" % pfn))
-        with open(pfn, "rb") as palFile:
-            paldata = palFile.read()
+        paldata = readPalette(pfn)
     else:
         paldata = None
+    return (ext, imagedata, paldata, w, h)
 
-    # Convert to PNG
+def readImage(fn):
+    """
+    Reads fn as a multi-file image if its extension ends in y, that is pixel
+    data only with a separate palette file, and as a single file otherwise.
+    """
+    if 'y' == parseFilename(fn)[-1][-1]:
+        return readMultiFileImage(fn)
+    return readSingleFileImage(fn)
+
+def pngImage(fn, cache=None, profile=None):
+    """
+    Returns the PNG for image file fn as bytes, converted in memory.
+    profile names an N64img.exportProfiles entry; None keeps the defaults.
+    With a cache.AssetCache results are looked up by the contents of the
+    source files, the dimensions and format from the file name and profile.
+    """
+    if cache is not None:
+        key = cache.key(sourceDigest(fn).encode(), parseFilename(fn)[1:], profile)
+        return cache.getOrCreate(key, lambda: pngImage(fn, profile=profile))
+    (ext, imagedata, paldata, w, h) = readImage(fn)
+    return N64img.img('png', 'out', cmd=ext, img=imagedata, pal=paldata,
+                      width=w, height=h, profile=profile)
+
+def writeTempPng(image):
+    (ext, imagedata, paldata, w, h) = image
     fd,tmpFilePath = tempfile.mkstemp()
     os.close(fd)
     N64img.img('png', 'out', cmd=ext, img=imagedata, pal=paldata,
                width=w, height=h, name=tmpFilePath)
     return tmpFilePath
 
+def processSingleFileImage(fn):
+    return writeTempPng(readSingleFileImage(fn))
+
+def processMultiFileImage(fn):
+    return writeTempPng(readMultiFileImage(fn))
+
+def isImageFile(fn):
+    """
+    True if fn is named title.WxH.ext with ext (less any trailing y) a format
+    N64img can export.
+    """
+    try:
+        ext = parseFilename(fn)[-1]
+    except ValueError:
+        return False
+    if ext.endswith('y'):
+        ext = ext[:-1]
+    return ('png', 'out', ext) in N64img.codecs
+
+def sourceFiles(fn):
+    """
+    Returns the existing files the image fn is built from: fn itself and
+    its palette file for multi-file indexed images.
+    """
+    ext = parseFilename(fn)[-1]
+    if 'y' == ext[-1] and ext[:-1] in paletteFormats:
+        pfn = getPaletteFileName(fn)
+        if os.path.exists(pfn):
+            return [fn, pfn]
+    return [fn]
+
+def sourceDigest(fn):
+    h = hashlib.sha1()
+    for s in sourceFiles(fn):
+        with open(s, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def upToDate(fn, outname, digest=None, manifest=None):
+    """
+    True if outname exists and is current for the image fn. With a manifest
+    (dict of outname to digest) the sources' digest must match the recorded
+    one, otherwise outname must be no older than any source file.
+    """
+    if not os.path.exists(outname):
+        return False
+    if manifest is not None:
+        return manifest.get(outname) == (digest or sourceDigest(fn))
+    mtime = os.path.getmtime(outname)
+    return all(os.path.getmtime(s) <= mtime for s in sourceFiles(fn))
+
+def convertImage(job):
+    """
+    Decodes one image and writes it as PNG. job is a tuple of
+    (path, outname, profile) so it can be sent to a worker process.
+    Returns a ConvertResult, or None if the image could not be converted.
+    """
+    fn, outname, profile = job
+    t = time.perf_counter()
+    try:
+        size = sum(os.path.getsize(s) for s in sourceFiles(fn))
+        data = pngImage(fn, profile=profile)
+    except Exception as e:
+        # Malformed sources fail in many ways (png.Error, struct.error,
+        # TypeError...); one bad file must not abort the whole batch.
+        log.warning("Failed to convert {}: {}: {}".format(fn, type(e).__name__, e))
+        return None
+    d = os.path.dirname(outname)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(outname, "wb") as f:
+        f.write(data)
+    return ConvertResult(fn, outname, size, len(data), time.perf_counter() - t)
+
+def imageJobs(paths, outdir=None):
+    """
+    Lists (path, outname) for every image file in paths (files or
+    directories). PNGs go next to each input, or under outdir keeping the
+    layout below any directory given.
+    """
+    jobs = []
+    for fn, rel in batch.listFiles(paths):
+        if not isImageFile(fn):
+            continue
+        png = getPngFileName(fn)
+        if outdir is None:
+            outname = os.path.join(os.path.dirname(fn), png)
+        else:
+            outname = os.path.join(outdir, os.path.dirname(rel), png)
+        jobs.append((fn, outname))
+    return jobs
+
+def convertImages(paths, outdir=None, workers=None, force=False, manifest=None, profile=None):
+    """
+    Converts every image in paths to PNG across workers processes, skipping
+    those whose output is up to date unless force is set. profile names an
+    N64img.exportProfiles entry. manifest is the
+    name of a JSON file of content digests to compare against instead of
+    mtimes; it is updated with the images converted.
+    Returns (results, skipped): a list of ConvertResult in input order and
+    the number of images skipped. workers=1 converts in this process.
+    """
+    jobs = imageJobs(paths, outdir)
+    recorded = digests = None
+    if manifest is not None:
+        try:
+            with open(manifest) as f:
+                recorded = json.load(f)
+        except FileNotFoundError:
+            recorded = {}
+        digests = {outname: sourceDigest(fn) for fn, outname in jobs}
+    total = len(jobs)
+    if not force:
+        jobs = [(fn, outname) for fn, outname in jobs if not upToDate(
+            fn, outname, digests.get(outname) if digests else None, recorded)]
+    skipped = total - len(jobs)
+    jobs = [(fn, outname, profile) for fn, outname in jobs]
+    if workers == 1:
+        results = [convertImage(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(convertImage, jobs, chunksize=4))
+    results = [r for r in results if r is not None]
+    if manifest is not None:
+        recorded.update((r.outname, digests[r.outname]) for r in results)
+        with open(manifest, "w") as f:
+            json.dump(recorded, f, indent=1, sort_keys=True)
+    return results, skipped
+
+def benchmarkProfiles(paths, profiles=None):
+    """
+    Converts every image in paths in memory with each export profile.
+    Returns a list of (profile, images, seconds, PNG bytes) per profile.
+    """
+    images = []
+    for fn, rel in batch.listFiles(paths):
+        if not isImageFile(fn):
+            continue
+        try:
+            # Convert once up front so images that fail are left out of
+            # every profile's timing, as convertImage skips them.
+            image = readImage(fn)
+            N64img.img('png', 'out', cmd=image[0], img=image[1], pal=image[2],
+                       width=image[3], height=image[4], profile='preview')
+        except Exception as e:
+            log.warning("Failed to convert {}: {}: {}".format(fn, type(e).__name__, e))
+            continue
+        images.append(image)
+    results = []
+    for profile in (profiles or N64img.exportProfiles):
+        size = 0
+        t = time.perf_counter()
+        for (ext, imagedata, paldata, w, h) in images:
+            size += len(N64img.img('png', 'out', cmd=ext, img=imagedata, pal=paldata,
+                                   width=w, height=h, profile=profile))
+        results.append((profile, len(images), time.perf_counter() - t, size))
+    return results
+
 def main():
-    infilename = "game_over.256x32.ci8y"
-    tmpfilename = processMultiFileImage(infilename)
-    outfilename = getPngFileName(infilename)
-    os.rename(tmpfilename, outfilename)
+    parser = argparse.ArgumentParser(description="Convert N64 textures named title.WxH.fmt to PNG.")
+    parser.add_argument("paths", nargs="*", default=["game_over.256x32.ci8y"], help="image files or directories")
+    parser.add_argument("-o", "--outdir", default=None, help="output directory (default: next to input)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("-f", "--force", action="store_true", help="convert even if the PNG is up to date")
+    parser.add_argument("--manifest", default=None, help="JSON file of source hashes to detect changes instead of mtimes")
+    parser.add_argument("-p", "--profile", choices=sorted(N64img.exportProfiles), default=None, help="PNG export profile")
+    parser.add_argument("--benchmark", action="store_true", help="compare time and size of each export profile, writing nothing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARN)
+
+    if args.benchmark:
+        for profile, n, t, size in benchmarkProfiles(args.paths):
+            print("{:10} {} images in {:.2f}s ({:.1f} images/s), {} bytes".format(
+                profile, n, t, (n / t) if t else 0.0, size))
+        return
+
+    t = time.perf_counter()
+    results, skipped = convertImages(args.paths, args.outdir, args.workers, args.force, args.manifest, args.profile)
+    t = time.perf_counter() - t
+    size = sum(r.size for r in results)
+    print("{} images converted, {} up to date, in {:.2f}s".format(len(results), skipped, t))
+    if results and t > 0:
+        print("{:.1f} images/s, {:.2f} MB/s".format(len(results) / t, size / t / 1e6))
 
 if __name__ == '__main__':
     main()
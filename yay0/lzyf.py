@@ -1,13 +1,13 @@
-# Compressor for LZYF
+# Compressor and decompressor for LZYF
 
-import yay0, logging, struct
+import yay0, logging, struct, bisect
 
 maxOffsets = [16, 32, 1024]
 maxLengths = {16: 513, 32: 4, 1024: 17}
 log = logging.getLogger("lzyf")
 
-def create_lzyf(data):
-    c = compress(data)
+def create_lzyf(data, progress=None):
+    c = compress(data, progress)
     out = bytearray(b'LZYF1000')
     out.extend((16+len(c)).to_bytes(4, byteorder='big'))
     out.extend(len(data).to_bytes(4, byteorder='big'))
@@ -57,7 +57,8 @@ def ocrl(index, src, maxOffset, maxLength):
             currRun += 1
             pos += 1
             if currRun == maxLength:
-                log.debug("Found run of length {} == {}. Returning...".format(currRun, maxLength))
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Found run of length {} == {}. Returning...".format(currRun, maxLength))
                 return (startPos, maxLength) #found best possible run
             if (pos >= size) or ((index+currRun) >= size):
                 break
@@ -92,7 +93,8 @@ def rcrl(index, src, maxOffset, maxLength):
             currRun += 1
             pos += 1
             if currRun == maxLength:
-                log.debug("Found run of length {} == {}. Returning...".format(currRun, maxLength))
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Found run of length {} == {}. Returning...".format(currRun, maxLength))
                 return (startPos, maxLength) #found best possible run
             if (pos >= size) or ((index+currRun) >= size):
                 break
@@ -108,11 +110,162 @@ def rcrl(index, src, maxOffset, maxLength):
         # Return the index from where the longest run was found
         return (runs[max(runs.keys())], max(runs.keys()))
 
+class SortedWindow:
+    """
+    The positions in a sliding window over src, kept sorted by the
+    keyLength bytes starting at each of them, similar to the binary tree
+    match finder of LZMA. The longest match for a position is with one of
+    its neighbours in that order, so a lookup is a bisection and usually
+    two comparisons. Positions must be looked up in increasing order for
+    the window to slide cheaply; going back rebuilds it.
+    """
+    def __init__(self, src, maxOffset, keyLength):
+        self.src = src
+        self.maxOffset = maxOffset
+        self.keyLength = keyLength
+        self.keys = []
+        self.lo = 0
+        self.hi = 0
+
+    def seek(self, index):
+        """
+        Slides the window to hold positions [index-maxOffset, index).
+        """
+        src = self.src
+        keys = self.keys
+        k = self.keyLength
+        lo = max(0, index - self.maxOffset)
+        if (index < self.hi) or (lo >= self.hi):
+            del keys[:]
+            self.lo = self.hi = lo
+        while self.lo < lo:
+            del keys[bisect.bisect_left(keys, (src[self.lo:self.lo+k], self.lo))]
+            self.lo += 1
+        while self.hi < index:
+            bisect.insort(keys, (src[self.hi:self.hi+k], self.hi))
+            self.hi += 1
+
+    def find(self, index, maxOffset, maxLength):
+        """
+        Returns (pos, length) of the longest match for index within
+        maxOffset bytes before it, or (-1, 0).
+        """
+        self.seek(index)
+        src = self.src
+        keys = self.keys
+        limit = min(maxLength, self.keyLength, len(src) - index)
+        stopPos = index - maxOffset
+        i = bisect.bisect_left(keys, (src[index:index+self.keyLength], index))
+        bestPos, bestLen = -1, 0
+        for j, step in ((i-1, -1), (i, 1)):
+            # Matches only get shorter moving away from i, so stop at the
+            # first one inside the window or once they can't beat bestLen.
+            while 0 <= j < len(keys):
+                p = keys[j][1]
+                l = yay0.matchLength(src, p, index, 0, limit)
+                if (l == 0) or (l < bestLen):
+                    break
+                if p >= stopPos:
+                    if (l > bestLen) or (p > bestPos):
+                        bestPos, bestLen = p, l
+                    break
+                j += step
+        return (bestPos, bestLen)
+
+def bcrl(index, src, maxOffset, maxLength, window=None):
+    """
+    Returns starting position in source before index from where the max runlength is detected.
+    Windows of up to 64 bytes are scanned with rcrl. Larger ones are looked up in window,
+    a SortedWindow over src; without one a new window is built for this call only, so
+    repeated lookups should go through bcrlFinder instead.
+    """
+    if maxOffset <= 64:
+        return rcrl(index, src, maxOffset, maxLength)
+    if window is None:
+        window = SortedWindow(src, maxOffset, maxLength)
+    return window.find(index, maxOffset, maxLength)
+
+def bcrlFinder():
+    """
+    Returns a function working like bcrl that keeps its own SortedWindow per
+    src and window size between calls. Use one per compression, so that
+    concurrent compressions never share a window.
+    """
+    windows = {}
+    def find(index, src, maxOffset, maxLength):
+        w = windows.get(maxOffset)
+        if (maxOffset > 64) and ((w is None) or (w.src is not src) or (w.keyLength < maxLength)):
+            w = windows[maxOffset] = SortedWindow(src, maxOffset, maxLength)
+        return bcrl(index, src, maxOffset, maxLength, w)
+    return find
+
+# Run finders selectable as crl_func, by name.
+crl_funcs = {"crl": crl, "ocrl": ocrl, "rcrl": rcrl, "bcrl": bcrl}
+# Factories for run finders that keep state during one compression.
+crl_factories = {bcrl: bcrlFinder}
 crl_func = rcrl
 def checkRunlength(index, src, maxOffset, maxLength):
     return crl_func(index, src, maxOffset, maxLength)
 
-def compress(src):
+def runFinder():
+    """
+    Returns the run finder for one compression: crl_func, or a fresh
+    instance of it if it keeps state between calls.
+    """
+    factory = crl_factories.get(crl_func)
+    return factory() if factory else crl_func
+
+def rcrls(index, src):
+    """
+    Returns [(pos, length)] for each window in maxOffsets, the same as rcrl
+    would for that window and its maxLengths entry, in a single search.
+    Each step finds the nearest position matching at least one byte more
+    than the previous step, so the smaller windows can be answered from
+    the steps that stayed within them.
+    """
+    size = len(src)
+    limit = min(max(maxLengths.values()), size - index)
+    lo = max(0, index - maxOffsets[-1])
+    steps = []
+    l = 0
+    while l < limit:
+        p = src.rfind(src[index:index+l+1], lo, index+l)
+        if p < 0:
+            break
+        l = yay0.matchLength(src, p, index, l+1, limit)
+        steps.append((p, l))
+        # Later steps are further away; stop once no window can improve.
+        if not any((l < maxLengths[w]) and (p >= index - w) for w in maxOffsets):
+            break
+    runs = []
+    for w in maxOffsets:
+        best = 0
+        for p, l in steps:
+            if p < index - w:
+                break
+            best = l
+        best = min(best, maxLengths[w])
+        if best == 0:
+            runs.append((-1, 0))
+        else:
+            runs.append(next((p, best) for p, l in steps if l >= best))
+    return runs
+
+def checkRunlengths(index, src, find=None):
+    """
+    Returns [(pos, length)] for each window in maxOffsets using find,
+    by default crl_func.
+    """
+    find = find or crl_func
+    if find is rcrl:
+        return rcrls(index, src)
+    return [find(index, src, w, maxLengths[w]) for w in maxOffsets]
+
+def compress(src, progress=None):
+    """
+    Returns the LZYF control stream for src, without header.
+    progress works as for yay0.yay0Enc.
+    """
     src_size = len(src)
     dst_size = 0
     dst = bytearray()
@@ -121,20 +274,31 @@ def compress(src):
     ctrl_byte = 0
     buf = bytearray()
 
+    # Per-token tracing is only formatted when debug logging is enabled.
+    trace = log.isEnabledFor(logging.DEBUG)
     log.info("Start Encode")
     # Start a copy-run
     buf.append(src[src_pos])
     src_pos += 1
     rl += 1
+    nextRuns = None
+    find = runFinder()
+    nextReport = 0 if progress is not None else src_size
     # print("Under Test!")
     while src_pos < src_size:
-        pos0, len0 = checkRunlength(src_pos, src, maxOffsets[0], maxLengths[maxOffsets[0]])
-        pos1, len1 = checkRunlength(src_pos, src, maxOffsets[1], maxLengths[maxOffsets[1]])
-        pos2, len2 = checkRunlength(src_pos, src, maxOffsets[2], maxLengths[maxOffsets[2]])
+        if src_pos >= nextReport:
+            progress(src_pos, src_size)
+            nextReport = src_pos + yay0.progressStep
+        # Matches at src_pos were already found as the lookahead of the
+        # previous iteration whenever it emitted a single literal byte.
+        if nextRuns is not None and nextRuns[0] == src_pos:
+            runs = nextRuns[1]
+        else:
+            runs = checkRunlengths(src_pos, src, find)
+        (pos0, len0), (pos1, len1), (pos2, len2) = runs
         if src_pos+1 < src_size:
-            pos3, len3 = checkRunlength(src_pos+1, src, maxOffsets[0], maxLengths[maxOffsets[0]])
-            pos4, len4 = checkRunlength(src_pos+1, src, maxOffsets[1], maxLengths[maxOffsets[1]])
-            pos5, len5 = checkRunlength(src_pos+1, src, maxOffsets[2], maxLengths[maxOffsets[2]])
+            nextRuns = (src_pos+1, checkRunlengths(src_pos+1, src, find))
+            (pos3, len3), (pos4, len4), (pos5, len5) = nextRuns[1]
             # if src_pos+2 < src_size:
             #     pos6, len6 = checkRunlength(src_pos+2, src, maxOffsets[0], maxLengths[maxOffsets[0]])
             #     pos7, len7 = checkRunlength(src_pos+2, src, maxOffsets[1], maxLengths[maxOffsets[1]])
@@ -142,15 +306,16 @@ def compress(src):
             # else:
             #     pos6, len6, pos7, len7, pos8, len8 = (-1, 0, -1, 0, -1, 0)
         else:
-            pos3, len3, pos4, len4, pos5, len5, pos6, len6, pos7, len7, pos8, len8 = (-1, 0, -1, 0, -1, 0, -1, 0, -1, 0, -1, 0)
+            pos3, len3, pos4, len4, pos5, len5 = (-1, 0, -1, 0, -1, 0)
         # if (max(len0, len1+1, len2) >= 2) and ((max(len0, len1+1, len2)+2) >= max(len3, len4+1, len5, len6-2, len7-1, len8-2)):
         # if ((max(len0, len2) >= 2) and ((max(len0, len2)+2) >= max(len3, len5, len6-2, len8-2))):
         # if ((rl == 0) and (len1 > 0)) or ((max(len0, len2) >= 2) and ((max(len0, len2)+2) >= max(len3, len5, len6-2, len8-2))):
         if ((rl == 0) and (len1 > 0)) or ((max(len0, len2) >= 2) and ((max(len0, len2)+2) >= max(len3, len5))):
             # output existing copy run, if any
             if rl != 0:
-                log.info("Copy: C={}, dec[{}:{}] is enc[{}:{}]. Check rl {} vs {}, enc {} vs {}".format(
-                    bin(rl), src_pos-rl, src_pos, dst_size+1, dst_size+1+rl, rl, len(buf), dst_size+1+len(buf), len(dst)+1+len(buf)))
+                if trace:
+                    log.debug("Copy: C={}, dec[{}:{}] is enc[{}:{}]. Check rl {} vs {}, enc {} vs {}".format(
+                        bin(rl), src_pos-rl, src_pos, dst_size+1, dst_size+1+rl, rl, len(buf), dst_size+1+len(buf), len(dst)+1+len(buf)))
                 dst.append(rl)
                 dst.extend(buf)
                 dst_size += len(buf) + 1
@@ -160,8 +325,9 @@ def compress(src):
                 # encode pos0, len0 using C
                 v = src_pos-pos0-1
                 ctrl_byte = 0x2000 | ((v & 0x0F) << 9) | ((len0-2) & 0x1FF)
-                log.info("0x20: C={}, dec[{}:{}] is dec[{}:{}]. Check off {} len {}({}) bytes {} enc {} vs {}".format(
-                    bin(ctrl_byte), src_pos, src_pos+len0, pos0, pos0+len0, hex(v), hex(len0), hex(len0-2), ctrl_byte.to_bytes(2, byteorder='big'), dst_size+2, len(dst)+2))
+                if trace:
+                    log.debug("0x20: C={}, dec[{}:{}] is dec[{}:{}]. Check off {} len {}({}) bytes {} enc {} vs {}".format(
+                        bin(ctrl_byte), src_pos, src_pos+len0, pos0, pos0+len0, hex(v), hex(len0), hex(len0-2), ctrl_byte.to_bytes(2, byteorder='big'), dst_size+2, len(dst)+2))
                 dst.extend(ctrl_byte.to_bytes(2, byteorder='big'))
                 dst_size += 2
                 src_pos += len0
@@ -169,8 +335,9 @@ def compress(src):
                 # encode pos2, len2 using B
                 v = src_pos - pos2 - 1
                 ctrl_byte = 0x4000 | ((v<<4) & 0x3FF0) | ((len2-2) & 0x0F)
-                log.info("0x40: C={}, dec[{}:{}] is dec[{}:{}]. Check off {} len {}({}) bytes {} enc {} vs {}".format(
-                    bin(ctrl_byte), src_pos, src_pos+len2, pos2, pos2+len2, hex(v), hex(len2), hex(len2-2), ctrl_byte.to_bytes(2, byteorder='big'), dst_size+2, len(dst)+2))
+                if trace:
+                    log.debug("0x40: C={}, dec[{}:{}] is dec[{}:{}]. Check off {} len {}({}) bytes {} enc {} vs {}".format(
+                        bin(ctrl_byte), src_pos, src_pos+len2, pos2, pos2+len2, hex(v), hex(len2), hex(len2-2), ctrl_byte.to_bytes(2, byteorder='big'), dst_size+2, len(dst)+2))
                 dst.extend(ctrl_byte.to_bytes(2, byteorder='big'))
                 dst_size += 2
                 src_pos += len2
@@ -178,8 +345,9 @@ def compress(src):
                 # encode pos1, len1 using A
                 v = src_pos - pos1 - 1
                 ctrl_byte = 0x80 | ((v<<2) & 0x7c) | ((len1-1) & 0x03)
-                log.info("0x80: C={}, dec[{}:{}] is dec[{}:{}]. Check off {} len {}({}) byte {} enc {} vs {}".format(
-                    bin(ctrl_byte), src_pos, src_pos+len1, pos1, pos1+len1, hex(v), hex(len1), hex(len1-1), hex(ctrl_byte), dst_size+1, len(dst)+1))
+                if trace:
+                    log.debug("0x80: C={}, dec[{}:{}] is dec[{}:{}]. Check off {} len {}({}) byte {} enc {} vs {}".format(
+                        bin(ctrl_byte), src_pos, src_pos+len1, pos1, pos1+len1, hex(v), hex(len1), hex(len1-1), hex(ctrl_byte), dst_size+1, len(dst)+1))
                 dst.append(ctrl_byte)
                 dst_size += 1
                 src_pos += len1
@@ -189,16 +357,18 @@ def compress(src):
             rl += 1
             src_pos +=1
             if rl == 0x1F:
-                log.info("Copy: C={}, dec[{}:{}] is enc[{}:{}]. Check rl {} vs {}, enc {} vs {}".format(
-                    bin(rl), src_pos-rl, src_pos, dst_size+1, dst_size+1+rl, rl, len(buf), dst_size+1+len(buf), len(dst)+1+len(buf)))
+                if trace:
+                    log.debug("Copy: C={}, dec[{}:{}] is enc[{}:{}]. Check rl {} vs {}, enc {} vs {}".format(
+                        bin(rl), src_pos-rl, src_pos, dst_size+1, dst_size+1+rl, rl, len(buf), dst_size+1+len(buf), len(dst)+1+len(buf)))
                 dst.append(rl)
                 dst.extend(buf)
                 dst_size += len(buf) + 1
                 buf = bytearray()
                 rl = 0
     if rl != 0:
-        log.info("Copy: C={}, dec[{}:{}] is enc[{}:{}]. Check rl {} vs {}, enc {} vs {}".format(
-            bin(rl), src_pos-rl, src_pos, dst_size+1, dst_size+1+rl, rl, len(buf), dst_size+1+len(buf), len(dst)+1+len(buf)))
+        if trace:
+            log.debug("Copy: C={}, dec[{}:{}] is enc[{}:{}]. Check rl {} vs {}, enc {} vs {}".format(
+                bin(rl), src_pos-rl, src_pos, dst_size+1, dst_size+1+rl, rl, len(buf), dst_size+1+len(buf), len(dst)+1+len(buf)))
         dst.append(rl)
         dst.extend(buf)
         dst_size += len(buf) + 1
@@ -206,10 +376,144 @@ def compress(src):
         rl = 0
     dst.append(0)
     dst_size += 1
+    if progress is not None:
+        progress(src_size, src_size)
     log.info("Zero byte at {}({}). src[0:{}]".format(dst_size, len(dst), src_pos))
     log.info("Encoded {} into {} bytes.".format(src_size, dst_size))
     return dst
 
+def extract_lzyf(data):
+    """
+    Returns the decoded contents of a complete LZYF file held in data.
+    """
+    d = LzyfDecoder()
+    out = d.feed(data)
+    d.flush()
+    return out
+
+def decompress(src):
+    """
+    Decodes a bare compress() stream, without the LZYF header.
+    """
+    d = LzyfDecoder(header=False)
+    out = d.feed(src)
+    d.flush()
+    return out
+
+class LzyfDecoder:
+    """
+    Incremental LZYF decoder. Pass compressed data to feed() in chunks of
+    any size; each call returns the bytes decoded so far that were not
+    returned before. Only the last maxOffsets[-1] decoded bytes are kept for
+    back-references. Call flush() at the end to check the stream was
+    complete.
+
+    Control bytes, as emitted by compress():
+        1xxxxxll                    copy l+1 bytes from offset x
+        01xxxxxx xxxxllll           copy l+2 bytes from offset x
+        001xxxxl llllllll           copy l+2 bytes from offset x
+        000nnnnn                    n literal bytes follow, 0 ends the stream
+    Offsets count back from the last byte written.
+
+    header  if True (default) the input starts with the 16 byte LZYF1000
+            header written by create_lzyf.
+    """
+    def __init__(self, header=True):
+        self.header = header
+        self.size = None
+        self.decoded = 0
+        self.eof = False
+        self.pending = bytearray()
+        self.window = bytearray()
+
+    def feed(self, chunk):
+        pending = self.pending
+        if self.eof:
+            return b''
+        pending.extend(chunk)
+        pos = 0
+        if self.header and self.size is None:
+            if len(pending) < 16:
+                return b''
+            if pending[:8] != b'LZYF1000':
+                raise ValueError("Not an LZYF1000 stream: {}".format(bytes(pending[:8])))
+            self.size = int.from_bytes(pending[12:16], byteorder='big')
+            pos = 16
+        out = self.window
+        start = len(out)
+        size = len(pending)
+        while pos < size:
+            c = pending[pos]
+            if c & 0x80:
+                count = (c & 0x03) + 1
+                src_pos = len(out) - ((c >> 2) & 0x1F) - 1
+                pos += 1
+            elif c & 0x60:
+                if pos+1 >= size:
+                    break
+                v = (c << 8) | pending[pos+1]
+                if c & 0x40:
+                    count = (v & 0x0F) + 2
+                    src_pos = len(out) - ((v >> 4) & 0x3FF) - 1
+                else:
+                    count = (v & 0x1FF) + 2
+                    src_pos = len(out) - ((v >> 9) & 0x0F) - 1
+                pos += 2
+            elif c:
+                if pos+c >= size:
+                    break
+                out.extend(pending[pos+1:pos+1+c])
+                pos += c+1
+                continue
+            else:
+                self.eof = True
+                pos += 1
+                break
+            if src_pos < 0:
+                raise ValueError("Reference before start of data at {} decoded bytes.".format(self.decoded+len(out)-start))
+            dst_pos = len(out)
+            out.extend(bytes(count))
+            yay0.copyLink(out, dst_pos, src_pos, count)
+        del pending[:pos]
+        decoded = bytes(out[start:])
+        self.decoded += len(decoded)
+        if len(out) > maxOffsets[-1]:
+            del out[:len(out)-maxOffsets[-1]]
+        return decoded
+
+    def flush(self):
+        """
+        Checks that the end of the stream was reached and, with a header,
+        that the decoded size matches it. Returns any remaining bytes, which
+        is always empty as feed() returns everything it decodes.
+        """
+        if not self.eof:
+            raise ValueError("Truncated LZYF stream after {} decoded bytes.".format(self.decoded))
+        if self.header and self.decoded != self.size:
+            raise ValueError("Decoded {} bytes, expected {}.".format(self.decoded, self.size))
+        return b''
+
+def compareRunlengthFuncs(data, names=None):
+    """
+    Compresses data with each named crl_funcs entry and returns a list of
+    (name, compressed size, seconds). crl_func is restored afterwards.
+    """
+    import time
+    global crl_func
+    saved = crl_func
+    results = []
+    try:
+        for name in (names or crl_funcs):
+            crl_func = crl_funcs[name]
+            t = time.perf_counter()
+            size = len(compress(data))
+            t = time.perf_counter() - t
+            log.info("{}: {} -> {} bytes in {:.3f}s".format(name, len(data), size, t))
+            results.append((name, size, t))
+    finally:
+        crl_func = saved
+    return results
+
 def analyzeRuns(data):
     for i in range(len(data)):
         p, l = checkRunlength(i, data, 1024, 513)
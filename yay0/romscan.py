@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Locates and extracts every Yay0 block in a large binary such as a ROM image.
+
+import os, mmap, struct, logging, argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import yay0
+
+log = logging.getLogger("romscan")
+
+# Largest decoded size accepted for a block, to reject false positives early.
+maxDecodedSize = 0x800000
+
+ScanResult = namedtuple("ScanResult", ['offset', 'packed', 'size', 'outname'])
+
+def findYay0(data, maxSize=maxDecodedSize):
+    """
+    Yields the offset of every b"Yay0" signature in data whose header
+    looks sane: a non-empty decoded size of at most maxSize and word
+    aligned tables that lie in order within data. Hits still have to pass
+    yay0.yay0Extent to be certain.
+    """
+    size = len(data)
+    pos = data.find(b"Yay0")
+    while pos >= 0:
+        if pos+0x10 <= size:
+            decoded_size, o_lt, o_bccm = yay0.yay0Header(data, pos)
+            if ((0 < decoded_size <= maxSize) and (0x14 <= o_lt <= o_bccm)
+                    and ((o_lt & 3) == 0) and ((o_bccm - o_lt) & 1) == 0
+                    and (pos+o_bccm <= size)):
+                yield pos
+        pos = data.find(b"Yay0", pos+1)
+
+def extractBlock(job):
+    """
+    Validates and decodes the block at offset in the file fn and writes
+    it to outname. job is a tuple of (fn, offset, outname) so it can be
+    sent to a worker process, which maps the file itself.
+    Returns a ScanResult, or None if the block turns out to be invalid.
+    """
+    fn, offset, outname = job
+    with open(fn, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        try:
+            packed = yay0.yay0Extent(m, offset)
+            out = yay0.yay0Dec(m, offset)
+        except (ValueError, IndexError, struct.error) as e:
+            log.debug("Rejected block at {:#x}: {}".format(offset, e))
+            return None
+    with open(outname, "wb") as f:
+        f.write(out)
+    return ScanResult(offset, packed, len(out), outname)
+
+def scanFile(fn, outdir=None, workers=None, maxSize=maxDecodedSize):
+    """
+    Finds every Yay0 block in the file fn, decodes them across workers
+    processes into outdir (default: fn + "_yay0") as <offset>.bin and writes
+    index.csv there listing offset, compressed size, decoded size and file
+    name of each block. Returns the list of ScanResult in file order.
+    workers=1 decodes in this process.
+    """
+    if outdir is None:
+        outdir = fn + "_yay0"
+    os.makedirs(outdir, exist_ok=True)
+    with open(fn, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        jobs = [(fn, pos, os.path.join(outdir, "{:08X}.bin".format(pos))) for pos in findYay0(m, maxSize)]
+    log.info("{} candidate blocks in {}".format(len(jobs), fn))
+    if workers == 1:
+        results = [extractBlock(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(extractBlock, jobs, chunksize=8))
+    results = [r for r in results if r is not None]
+    with open(os.path.join(outdir, "index.csv"), "w") as f:
+        f.write("offset,packed,size,name\n")
+        for r in results:
+            f.write("{:#010x},{},{},{}\n".format(r.offset, r.packed, r.size, os.path.basename(r.outname)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract every Yay0 block from a binary.")
+    parser.add_argument("rom", help="file to scan")
+    parser.add_argument("-o", "--outdir", default=None, help="output directory (default: <rom>_yay0)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-size", type=int, default=maxDecodedSize, help="largest decoded size to accept")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARN)
+
+    results = scanFile(args.rom, args.outdir, args.workers, args.max_size)
+    for r in results:
+        print("{:#010x}: {} -> {} bytes".format(r.offset, r.packed, r.size))
+    print("{} blocks, {} bytes decoded".format(len(results), sum(r.size for r in results)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import unittest
+import random
+from array import array
+import N64img
+
+
+def pixels(size, seed=1):
+    r = random.Random(seed)
+    return bytes(r.getrandbits(8) for _ in range(size))
+
+
+class TestN64img(unittest.TestCase):
+    def test_unpack_rgb16(self):
+        data = pixels(2 * N64img._rgb16TableMin)
+        for order, src in (('rgba', 'rgba'), ('rgb', 'rgba'), ('argb', 'rgba'), ('rgba', 'bgra')):
+            a = array("H", data)
+            a.byteswap()
+            self.assertEqual(N64img.unpackRGB(data, 16, order, src),
+                             N64img._unpack16(a, order, src))
+
+    def test_unpack_rgb32(self):
+        data = pixels(64)
+        out = N64img.unpackRGB(data, 32, 'argb', 'rgba')
+        for i in range(0, len(data), 4):
+            self.assertEqual(out[i:i+4], bytes((data[i+3], data[i], data[i+1], data[i+2])))
+        out = N64img.unpackRGB(data[:48], 24, 'bgr', 'rgb')
+        self.assertEqual(out[4:8], bytes((data[5], data[4], data[3], 0)))
+
+    def test_splitter(self):
+        data = pixels(300)
+        for mode in ('ia8', 'i4', 'ci4', 'ia4', 'i24', 'i28'):
+            self.assertEqual(N64img.splitter(data, mode),
+                             b''.join(N64img._splitbyte(i, mode) for i in data))
+        self.assertEqual(N64img.splitter(b'\xe4', 'i28'), b'\xff\xaa\x55\x00')
+        self.assertEqual(N64img.nibbleswap(bytearray(b'\x12\xab')), b'\x21\xba')
+
+    def test_redepth(self):
+        self.assertEqual(N64img.redepth(b'\x12\x34\x56', 8, 4), b'\x13')
+        self.assertEqual(N64img.redepth(b'\x12', 4, 8), b'\x01\x02')
+        self.assertEqual(N64img.redepth(b'\xb4', 2, 4), b'\x23\x10')
+        self.assertEqual(N64img.redepth(b'\xb4\x0f', 1, 2), b'\x45\x10\x00\x55')
+
+    def test_repack(self):
+        rows = [pixels(6, seed=r) for r in range(3)]
+        data = b''.join(rows)
+        # Reference conversions from the original per-byte loops.
+        ref = {(1, 4): bytearray(), (2, 4): bytearray()}
+        for j in data:
+            v = j
+            for k in range(4):
+                ref[(1, 4)].append(((v & 0x80) >> 3) | ((v & 0x40) >> 6))
+                v <<= 2
+            v = (j & 0xCC) >> 2
+            k = j & 0x33
+            ref[(2, 4)].append((v & 0x30) | k>>4)
+            ref[(2, 4)].append(((v << 4) & 0x30) | (k & 7))
+        for d in (1, 2, 4):
+            ref[(d, 8)] = bytearray((j >> (k-d)) & ((1 << d) - 1) for j in data for k in range(8, 0, -d))
+        ref[(4, 4)] = ref[(8, 8)] = data
+        for (d, o), expected in ref.items():
+            self.assertEqual(N64img._repack(iter(rows), 6, 3, d, o), expected)
+        self.assertEqual(N64img._repack(rows, 6, 3, 8, 4), bytes(
+            ((a & 15) << 4) | (b & 15) for a, b in zip(data[0::2], data[1::2])))
+        self.assertEqual(N64img._repack(rows, 6, 3, 8, 4, intensity=True), bytes(
+            (a & 0xF0) | (b >> 4) for a, b in zip(data[0::2], data[1::2])))
+        self.assertEqual(N64img._repack([b'\x12\x34\x56'], 3, 1, 8, 4), b'\x24\x60')
+
+    def test_clean_palette(self):
+        pal = b'\x00\x01\xff\xff\x00\x01\x12\x34\xff\xff'
+        p, t = N64img.cleanpalette(pal)
+        self.assertEqual(p, b'\x00\x01\xff\xff\x12\x34')
+        self.assertEqual(t[:6], bytes((0, 1, 0, 2, 1, 5)))
+
+    def test_quantize(self):
+        # Four flat colors survive exactly; the gradient is shared out.
+        flat = [(255, 0, 0, 255), (0, 255, 0, 255), (0, 0, 255, 255), (0, 0, 0, 0)]
+        rgba = b''.join(bytes(c) for c in flat) * 50
+        rgba += b''.join(bytes((i, i, i, 255)) for i in range(256))
+        for iterations in (0, 3):
+            pal, image = N64img.quantize(rgba, 16, iterations)
+            self.assertLessEqual(len(pal), 16)
+            self.assertEqual(len(image), len(rgba) // 4)
+            for n, c in enumerate(flat):
+                self.assertEqual(pal[image[n]], c)
+            for n in range(256):
+                r = pal[image[200+n]][0]
+                self.assertLess(abs(r - n), 40)
+        pal, image = N64img.quantize(rgba[:32], 256)
+        self.assertEqual(sorted(pal), sorted(flat))
+
+    def test_deinterlace(self):
+        data = pixels(8 * 20, seed=6)
+        expected = bytearray(data)
+        for row in range(1, 8, 2):
+            for w in range(row*20, row*20+16, 8):
+                expected[w:w+8] = data[w+4:w+8] + data[w:w+4]
+        self.assertEqual(N64img.deinterlace(data, 8), expected)
+        buf = bytearray(data)
+        self.assertIs(N64img.deinterlace(buf, 8, inplace=True), buf)
+        self.assertEqual(buf, expected)
+        self.assertEqual(N64img.deinterlace(data, 8, inplace=True), expected)
+
+    def test_scanlines(self):
+        data = pixels(2 * 40 * 30, seed=7)
+        rows = list(N64img._scanlines(data, 80, 30, lambda r: N64img.unpackRGB(r, 16)))
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(b''.join(rows), N64img.unpackRGB(data, 16))
+        self.assertEqual(list(N64img._words(b'\x12\x34\xab\xcd')), [0x1234, 0xabcd])
+
+    def test_profiles(self):
+        self.assertEqual(set(N64img.exportProfiles), {"preview", "balanced", "archive"})
+        self.assertRaises(ValueError, N64img.img, 'png', 'out', cmd='i8', img=bytes(4),
+                          width=2, profile="tiny")
+
+    def test_codecs(self):
+        self.assertIs(N64img.findcodec('png', 'out', 'c16'), N64img.pngout.c16)
+        self.assertIs(N64img.findcodec('png', 'imp', frmt='ci', depth=1), N64img.pngimp.ci8)
+        self.assertRaises(NotImplementedError, N64img.findcodec, 'png', 'out', frmt=1, depth=1)
+        self.assertRaises(ValueError, N64img.findcodec, 'png', 'out')
+        calls = []
+        def raw(img, width, name, **kwargs):
+            calls.append(kwargs)
+            name.write(bytes(img))
+        saved = dict(N64img.formatNames)
+        # Typecodes already used by pngout.i8, under a new cmd name.
+        N64img.register('raw', 'out', 'gray8', raw, frmt='i', depth=1)
+        try:
+            self.assertEqual(N64img.img('raw', 'out', cmd='gray8', img=b'ab', width=2), b'ab')
+            self.assertEqual(N64img.img('raw', 'out', frmt=4, depth=1, img=b'cd', width=2, profile='preview'), b'cd')
+            self.assertEqual(calls[-1], {'compress': 1})
+            self.assertIs(N64img.findcodec('png', 'out', frmt=4, depth=1), N64img.pngout.i8)
+            if N64img.png is not None:
+                self.assertTrue(N64img.img('png', 'out', frmt=4, depth=1, img=b'ef', width=2, height=1))
+        finally:
+            del N64img.codecs[('raw', 'out', 'gray8')]
+            N64img.formatNames.clear()
+            N64img.formatNames.update(saved)
+
+    def test_gbplanes(self):
+        data = pixels(64, seed=8)
+        values = []
+        for n in range(0, len(data), 2):
+            i, j = data[n], data[n+1]
+            for x in range(8):
+                values.append(((i&0x80)>0) | (((j&0x80)>0)<<1))
+                i <<= 1
+                j <<= 1
+        packed = bytes((a<<6)|(b<<4)|(c<<2)|d for a, b, c, d in zip(*[iter(values)]*4))
+        self.assertEqual(N64img.gbplanes(data), packed)
+        self.assertEqual(N64img._repack([packed], len(packed), 1, 2, 8), bytes(values))
+
+    def test_swap32(self):
+        self.assertEqual(N64img._swap32(b'\x01\x02\x03\x04\x05'), b'\x04\x03\x02\x01\x00\x00\x00\x05')
+
+    @unittest.skipIf(N64img.png is None, "requires pypng")
+    def test_export_color(self):
+        def read(data):
+            w, h, rows, meta = N64img.png.Reader(bytes=data).asRGBA8()
+            return w, h, b''.join(bytes(r) for r in rows)
+        data = pixels(2 * 16 * 8, seed=9)
+        out = N64img.img('png', 'out', cmd='c16', width=16, img=data)
+        self.assertEqual(read(out), (16, 8, N64img.unpackRGB(data, 16)))
+        out = N64img.img('png', 'out', cmd='c16', width=16, img=data, interlaced=True)
+        self.assertEqual(read(out), (16, 8, N64img.unpackRGB(N64img.deinterlace(data, 8), 16)))
+        data = pixels(4 * 16 * 8, seed=10)
+        out = N64img.img('png', 'out', cmd='c32', width=16, img=data, profile='preview')
+        self.assertEqual(read(out), (16, 8, data))
+
+    def test_palette(self):
+        pal = pixels(32, seed=3)
+        p = N64img.palette(bytearray(pal))
+        rgba = N64img.unpackRGB(pal, 16)
+        self.assertEqual(p, tuple(tuple(rgba[i:i+4]) for i in range(0, len(rgba), 4)))
+        self.assertIs(N64img.palette(pal), p)
+        p = N64img.palette(pal, alpha=False, order='BGRA')
+        self.assertEqual(p[0], (rgba[2], rgba[1], rgba[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import os
+import tempfile
+import batch
+import lzyf
+import yay0
+from test_yay0 import sample
+
+
+class TestBatch(unittest.TestCase):
+    def test_compress_files(self):
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "src")
+            os.makedirs(os.path.join(src, "sub"))
+            names = ["b.bin", "a.bin", os.path.join("sub", "c.bin")]
+            for n, name in enumerate(names):
+                with open(os.path.join(src, name), "wb") as f:
+                    f.write(sample(500 + n * 100, seed=n))
+            out = os.path.join(d, "out")
+            for fmt, decode in (("yay0", yay0.yay0Dec), ("lzyf", lzyf.extract_lzyf)):
+                results = batch.compressFiles([src], fmt, out, workers=2)
+                self.assertEqual([r.name for r in results],
+                                 [os.path.join(src, n) for n in sorted(names)])
+                for r in results:
+                    with open(r.name, "rb") as f, open(r.outname, "rb") as g:
+                        self.assertEqual(decode(g.read()), f.read())
+
+    def test_rerun_in_place(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "a.bin"), "wb") as f:
+                f.write(sample(300))
+            for run in range(2):
+                results = batch.compressFiles([d], "yay0", workers=1)
+                self.assertEqual([r.outname for r in results], [os.path.join(d, "a.bin.yay0")])
+            self.assertEqual(sorted(os.listdir(d)), ["a.bin", "a.bin.yay0"])
+
+    def test_compress_data(self):
+        data = sample(2000, seed=5)
+        for fmt in batch.formats:
+            out, t, verified = batch.compressData(data, fmt, verify=True)
+            self.assertTrue(verified)
+            self.assertEqual(batch.decoders[fmt](out), data)
+            self.assertIsNone(batch.compressData(data, fmt)[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import os
+import tempfile
+import cache
+
+
+class TestCache(unittest.TestCase):
+    def test_get_put(self):
+        with tempfile.TemporaryDirectory() as d:
+            c = cache.AssetCache(d, maxSize=1000, memoryItems=1)
+            k = c.key(b"texture", "32x32", "ci8")
+            self.assertNotEqual(k, c.key(b"texture", "32x32", "ci4"))
+            self.assertIsNone(c.get(k))
+            calls = []
+            make = lambda: calls.append(1) or b"png" * 10
+            self.assertEqual(c.getOrCreate(k, make), b"png" * 10)
+            self.assertEqual(c.getOrCreate(k, make), b"png" * 10)
+            self.assertEqual(len(calls), 1)
+            # A new instance finds the entry on disk.
+            c = cache.AssetCache(d, maxSize=1000)
+            self.assertEqual(c.size, 30)
+            self.assertEqual(c.get(k), b"png" * 10)
+
+    def test_memory_hit_touches_disk(self):
+        with tempfile.TemporaryDirectory() as d:
+            c = cache.AssetCache(d, memoryItems=4)
+            k = c.key(b"hot")
+            c.put(k, b"data")
+            os.utime(c.path(k), (1000, 1000))
+            self.assertEqual(c.get(k), b"data")
+            self.assertGreater(os.path.getmtime(c.path(k)), 1000)
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as d:
+            c = cache.AssetCache(d, maxSize=250, memoryItems=0)
+            keys = [c.key(bytes([i])) for i in range(4)]
+            for i, k in enumerate(keys):
+                c.put(k, bytes(100))
+                os.utime(c.path(k), (1000 + i, 1000 + i))
+                if i == 1:
+                    # Using the first entry keeps it past later puts.
+                    self.assertIsNotNone(c.get(keys[0]))
+                    os.utime(c.path(keys[0]), (1010, 1010))
+            self.assertLessEqual(c.size, 250)
+            self.assertEqual([c.get(k) is not None for k in keys], [True, False, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import os
+import tempfile
+import json
+import frontend
+
+
+class TestFrontend(unittest.TestCase):
+    def test_image_jobs(self):
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, "sub"))
+            for name in ("logo.64x32.ci8", "font.8x8.i4y", "font.pal",
+                         "readme.txt", os.path.join("sub", "bg.320x240.c16y")):
+                with open(os.path.join(d, name), "wb") as f:
+                    f.write(b"\0" * 16)
+            jobs = frontend.imageJobs([d], "out")
+            self.assertEqual(jobs, [
+                (os.path.join(d, "font.8x8.i4y"), os.path.join("out", "font.8x8.png")),
+                (os.path.join(d, "logo.64x32.ci8"), os.path.join("out", "logo.64x32.png")),
+                (os.path.join(d, "sub", "bg.320x240.c16y"), os.path.join("out", "sub", "bg.320x240.png")),
+            ])
+
+    def test_up_to_date(self):
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "logo.16x16.ci4y")
+            pal = os.path.join(d, "logo.pal")
+            out = os.path.join(d, "logo.16x16.png")
+            for name in (fn, pal, out):
+                with open(name, "wb") as f:
+                    f.write(b"\1" * 32)
+            self.assertEqual(frontend.sourceFiles(fn), [fn, pal])
+            os.utime(fn, (1000, 1000))
+            os.utime(pal, (1000, 1000))
+            os.utime(out, (2000, 2000))
+            self.assertTrue(frontend.upToDate(fn, out))
+            os.utime(pal, (3000, 3000))
+            self.assertFalse(frontend.upToDate(fn, out))
+
+            manifest = {out: frontend.sourceDigest(fn)}
+            self.assertTrue(frontend.upToDate(fn, out, manifest=manifest))
+            with open(pal, "wb") as f:
+                f.write(b"\2" * 32)
+            self.assertFalse(frontend.upToDate(fn, out, manifest=manifest))
+            self.assertFalse(frontend.upToDate(fn, out + "x", manifest=manifest))
+
+    @unittest.skipIf(frontend.N64img.png is None, "requires pypng")
+    def test_convert_images(self):
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, "src")
+            os.makedirs(src)
+            with open(os.path.join(src, "good.8x4.c16"), "wb") as f:
+                f.write(bytes(range(64)))
+            # Too short for its dimensions, so pypng rejects the rows.
+            with open(os.path.join(src, "bad.8x4.c16"), "wb") as f:
+                f.write(bytes(10))
+            manifest = os.path.join(d, "manifest.json")
+            with self.assertLogs("frontend", "WARNING"):
+                frontend.convertImages([src], os.path.join(d, "out"), 1, force=True)
+            for workers in (1, 2):
+                results, skipped = frontend.convertImages([src], os.path.join(d, "out"), workers,
+                                                          force=True, manifest=manifest)
+                self.assertEqual([os.path.basename(r.outname) for r in results], ["good.8x4.png"])
+            with open(manifest) as f:
+                self.assertEqual(list(json.load(f)), [results[0].outname])
+
+    @unittest.skipIf(frontend.N64img.png is None, "requires pypng")
+    def test_benchmark_profiles(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "good.8x4.c16"), "wb") as f:
+                f.write(bytes(range(64)))
+            with open(os.path.join(d, "bad.8x4.c16"), "wb") as f:
+                f.write(bytes(10))
+            # Palette file missing.
+            with open(os.path.join(d, "nopal.8x4.ci8y"), "wb") as f:
+                f.write(bytes(32))
+            with self.assertLogs("frontend", "WARNING") as cm:
+                results = frontend.benchmarkProfiles([d])
+            self.assertEqual(len(cm.output), 2)
+            self.assertEqual([r[0] for r in results], list(frontend.N64img.exportProfiles))
+            self.assertTrue(all(r[1] == 1 and r[3] > 0 for r in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import lzyf
+from test_yay0 import sample
+
+
+class TestLzyf(unittest.TestCase):
+    def test_roundtrip(self):
+        for data in (b'a', bytes(700), b'abcd' * 100, sample(1500)):
+            self.assertEqual(lzyf.extract_lzyf(lzyf.create_lzyf(data)), data)
+            self.assertEqual(lzyf.decompress(lzyf.compress(data)), data)
+
+    def test_rcrls(self):
+        data = sample(2500, seed=4)
+        for i in range(1, len(data)):
+            expected = [lzyf.rcrl(i, data, w, lzyf.maxLengths[w]) for w in lzyf.maxOffsets]
+            self.assertEqual(lzyf.rcrls(i, data), expected)
+
+    def test_bcrl(self):
+        data = sample(2500, seed=5)
+        find = lzyf.bcrlFinder()
+        for i in range(1, len(data)):
+            p, l = find(i, data, 1024, 17)
+            self.assertEqual(l, lzyf.rcrl(i, data, 1024, 17)[1])
+            if l:
+                self.assertTrue(i - 1024 <= p < i)
+                self.assertEqual(data[p:p+l], data[i:i+l])
+
+    def test_bcrl_roundtrip(self):
+        # Finders from separate compressions must not share windows, even
+        # when used alternately as by concurrent threads.
+        saved = lzyf.crl_func
+        lzyf.crl_func = lzyf.bcrl
+        try:
+            inputs = [sample(3000, seed=s) for s in (6, 7)]
+            finders = [lzyf.runFinder() for data in inputs]
+            self.assertIsNot(finders[0], finders[1])
+            for i in range(1, 3000, 5):
+                for find, data in zip(finders, inputs):
+                    p, l = find(i, data, 1024, 17)
+                    self.assertEqual(data[p:p+l], data[i:i+l])
+            with ThreadPoolExecutor(2) as pool:
+                for data, c in zip(inputs, pool.map(lzyf.compress, inputs)):
+                    self.assertEqual(lzyf.decompress(c), data)
+        finally:
+            lzyf.crl_func = saved
+
+    def test_streaming(self):
+        data = sample(3000, seed=3)
+        c = lzyf.create_lzyf(data)
+        d = lzyf.LzyfDecoder()
+        out = bytearray()
+        for i in range(0, len(c), 7):
+            out.extend(d.feed(c[i:i+7]))
+        out.extend(d.flush())
+        self.assertEqual(out, data)
+
+    def test_truncated(self):
+        c = lzyf.create_lzyf(sample(500))
+        d = lzyf.LzyfDecoder()
+        d.feed(c[:-10])
+        self.assertRaises(ValueError, d.flush)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import os
+import tempfile
+import romscan
+import yay0
+from test_yay0 import sample
+
+
+class TestRomScan(unittest.TestCase):
+    def test_scan_file(self):
+        a = sample(1500, seed=1)
+        b = sample(900, seed=2)
+        rom = bytearray(b'Yay0 but not a header' + bytes(11))
+        offsets = []
+        for data in (a, b):
+            offsets.append(len(rom))
+            rom += yay0.yay0Enc(data) + b'Yay0\x00\x00\x10\x00\x00\x00\x00\x14'
+        with tempfile.TemporaryDirectory() as d:
+            fn = os.path.join(d, "rom.z64")
+            with open(fn, "wb") as f:
+                f.write(rom)
+            results = romscan.scanFile(fn, workers=2)
+            self.assertEqual([r.offset for r in results], offsets)
+            for r, data in zip(results, (a, b)):
+                self.assertEqual(r.size, len(data))
+                self.assertEqual(r.packed, len(yay0.yay0Enc(data)))
+                with open(r.outname, "rb") as f:
+                    self.assertEqual(f.read(), data)
+            with open(os.path.join(fn + "_yay0", "index.csv")) as f:
+                self.assertEqual(len(f.readlines()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
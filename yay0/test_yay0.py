@@ -0,0 +1,70 @@
+import unittest
+import random
+import yay0
+
+
+def sample(size, seed=1):
+    r = random.Random(seed)
+    out = bytearray()
+    while len(out) < size:
+        out += bytes([r.randrange(4)]) * r.randrange(1, 40)
+        out += bytes(r.getrandbits(8) for _ in range(r.randrange(0, 8)))
+    return bytes(out[:size])
+
+
+class TestYay0(unittest.TestCase):
+    def test_roundtrip(self):
+        for data in (bytes(100), b'abc' * 50, sample(3000)):
+            for depth in yay0.matchDepths:
+                self.assertEqual(yay0.yay0Dec(yay0.yay0Enc(data, depth)), data)
+                self.assertEqual(yay0.yay0Dec(yay0.yay0Enc(data, depth, optimal=True)), data)
+
+    def test_decode_buffer(self):
+        data = sample(2000, seed=3)
+        blob = bytes(7) + yay0.yay0Enc(data) + bytes(5)
+        self.assertEqual(yay0.yay0Header(blob, 7)[0], len(data))
+        dest = bytearray(len(data) + 10)
+        out = yay0.yay0Dec(memoryview(blob), 7, memoryview(dest)[5:])
+        self.assertEqual(bytes(out[:len(data)]), data)
+        self.assertEqual(dest[5:5+len(data)], data)
+        self.assertRaises(ValueError, yay0.yay0Dec, blob, 7, bytearray(10))
+
+    def test_copy_link(self):
+        for distance in (0, 1, 2, 5, 17):
+            for count in (3, 5, 18, 40):
+                dest = bytearray(b'0123456789abcdefghij') + bytearray(count)
+                expected = bytearray(dest)
+                o_dest = 20
+                for r in range(count):
+                    expected[o_dest+r] = expected[o_dest-distance-1+r]
+                end = yay0.copyLink(dest, o_dest, o_dest-distance-1, count)
+                self.assertEqual(end, o_dest+count)
+                self.assertEqual(dest, expected)
+
+    def test_match_finder_exact(self):
+        data = sample(1200, seed=2)
+        finder = yay0.MatchFinder(data, 4096, 273, "max")
+        for i in range(1, len(data)):
+            pos, l = yay0.checkRunlength(i, len(data), data, 4096, 273)
+            if l < 3:
+                pos, l = (-1, 0)
+            self.assertEqual(finder.find(i), (pos, l))
+
+    def test_progress(self):
+        data = sample(3 * yay0.progressStep, seed=4)
+        for optimal in (False, True):
+            calls = []
+            out = yay0.yay0Enc(data, "fast", optimal, progress=lambda pos, size: calls.append((pos, size)))
+            self.assertEqual(out, yay0.yay0Enc(data, "fast", optimal))
+            self.assertGreaterEqual(len(calls), 3)
+            self.assertEqual(calls[-1], (len(data), len(data)))
+            self.assertEqual([c[0] for c in calls], sorted(c[0] for c in calls))
+
+        def stop(pos, size):
+            if pos:
+                raise KeyboardInterrupt
+        self.assertRaises(KeyboardInterrupt, yay0.yay0Enc, data, progress=stop)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,50 +8,140 @@ import struct, logging
 
 log = logging.getLogger("yay0")
 
+def copyLink(dest, o_dest, o_dest_cp, count):
+    """
+    Copies count bytes from dest[o_dest_cp:] to dest[o_dest:] as a byte-wise
+    forward copy would, and returns the new o_dest.
+    When the source overlaps the destination the bytes written form a
+    repeating pattern, so the period copied so far is reused as the source
+    and each chunk doubles in size.
+    """
+    end = min(o_dest + count, len(dest))
+    period = o_dest - o_dest_cp
+    if period >= count:
+        dest[o_dest:end] = dest[o_dest_cp:o_dest_cp+end-o_dest]
+        return end
+    while o_dest < end:
+        n = min(o_dest - o_dest_cp, end - o_dest)
+        dest[o_dest:o_dest+n] = dest[o_dest_cp:o_dest_cp+n]
+        o_dest += n
+    return o_dest
+
+def yay0Header(data, offset=0):
+    """
+    Returns (decoded size, link table offset, byte chunk offset) from the
+    Yay0 header at offset in data. Table offsets are relative to the header.
+    """
+    return struct.unpack_from(">III", data, offset+0x04)
+
+def yay0Extent(data, offset=0):
+    """
+    Walks the Yay0 stream at offset in data without decoding it and returns
+    its compressed size. Raises ValueError if the stream is inconsistent:
+    a table runs into the next one or past the end of data, or a link
+    refers to data before the start or past the decoded size.
+    """
+    decoded_size, o_lt, o_bccm = yay0Header(data, offset)
+    end_mt = o_lt
+    end_lt = o_bccm
+    size = len(data) - offset
+    if not (0x10 <= end_mt <= end_lt <= size):
+        raise ValueError("Bad table offsets {} {} for {} bytes.".format(o_lt, o_bccm, size))
+    o_mt = 0x10
+    o_dest = 0
+    while o_dest < decoded_size:
+        if o_mt+4 > end_mt:
+            raise ValueError("Mask table overrun at {}.".format(o_mt))
+        mask = struct.unpack_from(">I", data, offset+o_mt)[0]
+        o_mt += 4
+        mask_count = 32
+        while (mask_count > 0) and (o_dest < decoded_size):
+            if (0x80000000 & mask) != 0:
+                o_dest += 1
+                o_bccm += 1
+            else:
+                if o_lt+2 > end_lt:
+                    raise ValueError("Link table overrun at {}.".format(o_lt))
+                cnd = struct.unpack_from(">H", data, offset+o_lt)[0]
+                o_lt += 2
+                count = cnd >> 12
+                if count == 0:
+                    if o_bccm >= size:
+                        raise ValueError("Count byte past end of data at {}.".format(o_bccm))
+                    count = data[offset+o_bccm] + 18
+                    o_bccm += 1
+                else:
+                    count += 2
+                if (cnd & 0xfff) >= o_dest:
+                    raise ValueError("Link before start of data at {}.".format(o_dest))
+                o_dest += count
+            mask = (mask << 1) & 0xffffffff
+            mask_count -= 1
+    if o_dest > decoded_size:
+        raise ValueError("Decoded {} bytes, header says {}.".format(o_dest, decoded_size))
+    if o_bccm > size:
+        raise ValueError("Byte chunks run past end of data: {} > {}.".format(o_bccm, size))
+    return o_bccm
+
 # Yay0 decoder
 # A basic yay0 decompressor
-def yay0Dec(data):
+def yay0Dec(data, offset=0, dest=None):
     """
-    data    A stream of bytes
+    data    A stream of bytes; any buffer such as bytes, memoryview or mmap
+    offset  position of the Yay0 header within data
+    dest    optional writable buffer of at least the decoded size to decode
+            into, e.g. a bytearray or a memoryview slice of a larger one.
+            Defaults to a new bytearray.
+    Returns the buffer holding the decoded data.
     """
-    log.debug("Data: {} bytes. Preamble: {}".format(len(data),data[0:4]))
-    # data[4:8] has a 32-bit big-endian integer representing the uncompressed size
-    decoded_size = struct.unpack(">I", data[0x04:0x08])[0]
+    # Per-token tracing is only formatted when debug logging is enabled.
+    trace = log.isEnabledFor(logging.DEBUG)
+    log.debug("Data: {} bytes. Preamble: {} at {}".format(len(data), bytes(data[offset:offset+4]), offset))
+    # data[4:8] has a 32-bit big-endian integer representing the uncompressed size,
+    # followed by the offsets to the link table and to the byte chunks and count modifiers.
+    decoded_size, o_lt, o_bccm = yay0Header(data, offset)
     log.debug ("Determined decoded size: {}".format(decoded_size))
 
-    # initialize bytesarray of size decoded_size to hold uncompressed data
-    dest = bytearray(decoded_size)
-    log.info("Created dest: {} bytes.".format(len(dest)))
+    if dest is None:
+        # initialize bytesarray of size decoded_size to hold uncompressed data
+        dest = out = bytearray(decoded_size)
+        log.info("Created dest: {} bytes.".format(len(dest)))
+    else:
+        if len(dest) < decoded_size:
+            raise ValueError("Destination holds {} bytes, {} needed.".format(len(dest), decoded_size))
+        out = memoryview(dest)[:decoded_size]
 
     # o_lt = Offset to Link Table
-    o_lt = struct.unpack(">I", data[0x08:0x0c])[0]
-    o_mt_max = o_lt
+    o_lt += offset
     # o_bccm = Offset to byte chunks and count modifiers
-    o_bccm = struct.unpack(">I", data[0x0c:0x10])[0]
+    o_bccm += offset
     log.debug ("Link table at {} bytes and byte-chunks etc starting at {} bytes.".format(o_lt, o_bccm))
 
     # o_mt = Offset to mask table
-    o_mt = 0x10
+    o_mt = offset + 0x10
 
     # o_dest = Offset into destination bytesarray
     o_dest = 0
 
     while(o_dest < decoded_size):
-        mask = struct.unpack(">I", data[o_mt:o_mt+0x04])[0]
+        mask = struct.unpack_from(">I", data, o_mt)[0]
         mask_count = 32
-        log.debug("Mask: {} {} at {}".format(bin(mask), hex(mask), o_mt))
+        if trace:
+            log.debug("Mask: {} {} at {}".format(bin(mask), hex(mask), o_mt))
         o_mt += 4
-        log.debug("Moved o_mt to {}".format(o_mt))
+        if trace:
+            log.debug("Moved o_mt to {}".format(o_mt))
         while (mask_count > 0) and (o_dest < decoded_size):
             if (0x80000000 & mask) != 0:
                 # copy 1 byte from source to dest
                 # log.debug(mask_count, ": Unlinked Block. o_dest", o_dest, "(/", len(dest), ") o_bccm", o_bccm, "(/", len(data), ")")
-                log.debug("{}: Unlinked Block. o_dest {}/{} o_bccm {}/{}".format(mask_count, o_dest, len(dest), o_bccm, len(data)))
-                dest[o_dest] = data[o_bccm]
+                if trace:
+                    log.debug("{}: Unlinked Block. o_dest {}/{} o_bccm {}/{}".format(mask_count, o_dest, decoded_size, o_bccm, len(data)))
+                out[o_dest] = data[o_bccm]
                 o_dest += 1
                 o_bccm += 1
             else:
-                cnd = struct.unpack(">H", data[o_lt:o_lt+2])[0]
+                cnd = struct.unpack_from(">H", data, o_lt)[0]
                 o_lt += 2
                 distance = cnd & 0xfff
                 count = cnd >> 12
@@ -64,19 +154,17 @@ def yay0Dec(data):
                 o_dest_cp = o_dest - distance - 1
                 # log.debug(mask_count, ": Linked Block. Copy", count, "bytes from",
                 #       o_dest_cp, "to", o_dest, "at size", len(dest))
-                log.debug("{}: Linked Block. Copy {} bytes from {} to {} at size {}".format(mask_count, count, o_dest_cp,  o_dest, len(dest)))
-                # dest[o_dest:o_dest+count] = dest[o_dest_cp:o_dest_cp+count]
-                # o_dest += count
-                for r in range(count):
-                    dest[o_dest] = dest[o_dest_cp]
-                    o_dest += 1
-                    o_dest_cp += 1
+                if trace:
+                    log.debug("{}: Linked Block. Copy {} bytes from {} to {} at size {}".format(mask_count, count, o_dest_cp,  o_dest, decoded_size))
+                o_dest = copyLink(out, o_dest, o_dest_cp, count)
             mask = (mask << 1) & 0xffffffff
             mask_count -= 1
             # log.debug("With o_mt", o_mt, "o_lt", o_lt, "o_bccm", o_bccm,
             #       "o_dest", o_dest, "mask", mask, "mask_count", mask_count)
-            log.debug("With o_mt {} o_lt {} o_bccm {} o_dest {} mask {} mask_count {}".format(o_mt, o_lt, o_bccm, o_dest, mask, mask_count))
-        log.debug("{} :Getting next mask".format(mask_count))
+            if trace:
+                log.debug("With o_mt {} o_lt {} o_bccm {} o_dest {} mask {} mask_count {}".format(o_mt, o_lt, o_bccm, o_dest, mask, mask_count))
+        if trace:
+            log.debug("{} :Getting next mask".format(mask_count))
     log.info("Done decoding to {} bytes.".format(o_dest))
     return dest
 
@@ -97,7 +185,8 @@ def checkRunlength(index, size, src, maxOffset, maxLength):
             currRun += 1
             pos += 1
             if currRun == maxLength:
-                log.debug("Found run of length {} == {}. Returning...".format(currRun, maxLength))
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Found run of length {} == {}. Returning...".format(currRun, maxLength))
                 return (startPos, maxLength) #found best possible run
             if (pos >= size) or ((index+currRun) >= size):
                 break
@@ -113,12 +202,213 @@ def checkRunlength(index, size, src, maxOffset, maxLength):
         # Return the index from where the longest run was found
         return (runs[max(runs.keys())], max(runs.keys()))
 
-def yay0Enc(data):
+# Input bytes between calls to an encoder's progress callback; a power of 2.
+progressStep = 0x4000
+
+# Named chain depths for the hash-chain match finder. "max" walks every
+# candidate in the window and matches checkRunlength exactly.
+matchDepths = {"max": None, "normal": 128, "fast": 16}
+
+def matchLength(src, pos, index, start, limit):
+    """
+    Returns the length of the match between src[pos:] and src[index:], given
+    that the first start bytes are already known to match. Stops at limit.
+    """
+    l = start
+    while l < limit:
+        step = min(32, limit - l)
+        if src[pos+l:pos+l+step] == src[index+l:index+l+step]:
+            l += step
+        else:
+            while src[pos+l] == src[index+l]:
+                l += 1
+            break
+    return l
+
+class MatchFinder:
+    """
+    Hash-chain match finder over a fixed source buffer.
+    Positions are chained by a rolling hash of the next 3 bytes, so only
+    matches of 3 or more bytes are reported; shorter runs are never linked
+    by yay0Enc anyway.
+
+    depth   maximum number of chain entries to examine per lookup, a key of
+            matchDepths or None to examine all of them.
+    exact   if True ties go to the earliest position and every candidate is
+            examined, as in checkRunlength. Defaults to True for an
+            unlimited depth.
+    """
+    def __init__(self, src, maxOffset=4096, maxLength=273, depth=None, exact=None):
+        if isinstance(depth, str):
+            depth = matchDepths[depth]
+        self.src = src
+        self.maxOffset = maxOffset
+        self.maxLength = maxLength
+        self.depth = depth
+        self.exact = (depth is None) if exact is None else exact
+        size = len(src)
+        prev = [-1] * size
+        head = {}
+        if size >= 3:
+            h = (src[0] << 8) | src[1]
+            for i in range(size-2):
+                h = ((h << 8) | src[i+2]) & 0xffffff
+                prev[i] = head.get(h, -1)
+                head[h] = i
+        self.prev = prev
+
+    def find(self, index):
+        """
+        Returns (pos, length) of the longest match for src[index:] in the
+        window before index, or (-1, 0) if there is none of 3 or more bytes.
+        In exact mode ties go to the earliest position, as in
+        checkRunlength; otherwise to the most recent one.
+        """
+        src = self.src
+        limit = min(self.maxLength, len(src) - index)
+        if limit < 3:
+            return (-1, 0)
+        stopPos = max(0, index - self.maxOffset)
+        exact = self.exact
+        depth = self.depth
+        prev = self.prev
+        bestPos, bestLen = -1, 0
+        pos = prev[index]
+        while pos >= stopPos:
+            if bestPos < 0:
+                l = matchLength(src, pos, index, 3, limit)
+                bestPos, bestLen = pos, l
+            elif exact:
+                # Only an equal or longer match can replace the current one.
+                if src[pos:pos+bestLen] == src[index:index+bestLen]:
+                    bestPos = pos
+                    bestLen = matchLength(src, pos, index, bestLen, limit)
+            elif src[pos+bestLen] == src[index+bestLen]:
+                l = matchLength(src, pos, index, 3, limit)
+                if l > bestLen:
+                    bestPos, bestLen = pos, l
+            if not exact:
+                if bestLen == limit:
+                    break
+                if depth is not None:
+                    depth -= 1
+                    if depth <= 0:
+                        break
+            pos = prev[pos]
+        return (bestPos, bestLen)
+
+def optimalParse(data, finder, niceLength=64, progress=None):
+    """
+    Returns a list of (ref, length) steps through data with the least
+    encoded size, where ref < 0 marks an unlinked byte.
+    The longest match at each position comes from finder; any shorter
+    length from the same ref is also a candidate. Inside a match longer
+    than niceLength the next position reuses it, one byte shorter, instead
+    of searching again.
+    progress is passed to yay0Enc's, called during the match search.
+    """
+    size = len(data)
+    refs = [-1] * size
+    lens = [0] * size
+    ref, l = -1, 0
+    for i in range(1, size):
+        if progress is not None and (i & (progressStep-1)) == 0:
+            progress(i, size)
+        if l > niceLength:
+            ref = ref+1
+            l = matchLength(data, ref, i, l-1, min(finder.maxLength, size-i))
+        else:
+            ref, l = finder.find(i)
+        refs[i] = ref
+        lens[i] = l
+
+    # Costs in bits, counting the mask bit of each step: an unlinked byte,
+    # a 2-byte link, and a 2-byte link with an extra count byte.
+    cost = [0] * (size+1)
+    step = [1] * size
+    for i in range(size-1, -1, -1):
+        c = cost[i+1] + 9
+        best = 1
+        l = lens[i]
+        if l >= 3:
+            costs = cost[i+3:i+min(l, 17)+1]
+            m = min(costs)
+            if m + 17 < c:
+                c = m + 17
+                best = costs.index(m) + 3
+            if l >= 18:
+                costs = cost[i+18:i+l+1]
+                m = min(costs)
+                if m + 25 < c:
+                    c = m + 25
+                    best = costs.index(m) + 18
+        cost[i] = c
+        step[i] = best
+
+    tokens = []
+    i = 0
+    while i < size:
+        l = step[i]
+        tokens.append((refs[i] if l > 1 else -1, l))
+        i += l
+    return tokens
+
+def yay0Pack(data, tokens):
+    """
+    Returns a Yay0 stream encoding data as tokens, a list of (ref, length)
+    steps as returned by optimalParse.
+    """
+    mt = bytearray()
+    lt = bytearray()
+    dc = bytearray()
+    o_src = 0
+    mask = 0
+    mask_count = 32
+    for ref, length in tokens:
+        if ref < 0:
+            dc.append(data[o_src])
+            mask = mask | (1 << (mask_count-1))
+            o_src += 1
+        else:
+            offset = o_src - ref - 1
+            if length < 18:
+                lt.extend((((length-2) << 12) | offset).to_bytes(2, byteorder='big'))
+            else:
+                lt.extend(offset.to_bytes(2, byteorder='big'))
+                dc.append(length-18)
+            o_src += length
+        mask_count -= 1
+        if mask_count == 0:
+            mt.extend(mask.to_bytes(4, byteorder='big'))
+            mask = 0
+            mask_count = 32
+    if mask_count != 32:
+        mt.extend(mask.to_bytes(4, byteorder='big'))
+    dst = b'Yay0' + struct.pack(">III", len(data), len(mt)+16, len(mt)+len(lt)+16)
+    return dst + mt + lt + dc
+
+def yay0Enc(data, depth="max", optimal=False, progress=None):
     """
     data    a stream of bytes containing data to be compressed
+    depth   match finder chain depth, a key of matchDepths or an int.
+            "max" gives the same output as a full checkRunlength scan.
+    optimal if True picks the smallest encoding over all matches found
+            with optimalParse instead of the greedy lazy-match parse.
+            Much slower, so best combined with a smaller depth.
+    progress if given is called as progress(done, size) with the number of
+            input bytes consumed, about every progressStep bytes and at
+            the end. An exception raised from it aborts compression.
     """
     maxOffset = 4096
     maxRunLength = 273
+    if optimal:
+        finder = MatchFinder(data, maxOffset, maxRunLength, depth, exact=False)
+        out = yay0Pack(data, optimalParse(data, finder, progress=progress))
+        if progress is not None:
+            progress(len(data), len(data))
+        return out
+    finder = MatchFinder(data, maxOffset, maxRunLength, depth)
+    trace = log.isEnabledFor(logging.DEBUG)
     src_size = len(data)
     o_src = 0
     dc = bytearray()
@@ -131,9 +421,14 @@ def yay0Enc(data):
     o_mt = 0
     mask = 0
     mask_count = 32 # Number of bits left to fill in the mask
+    nextReport = 0 if progress is not None else src_size
     while o_src < src_size:
-        (ref, rlAtCurr) = checkRunlength(o_src, src_size, data, maxOffset, maxRunLength)
-        log.debug("At {} ref {} rlAtCurr {}".format(o_src, ref, rlAtCurr))
+        if o_src >= nextReport:
+            progress(o_src, src_size)
+            nextReport = o_src + progressStep
+        (ref, rlAtCurr) = finder.find(o_src)
+        if trace:
+            log.debug("At {} ref {} rlAtCurr {}".format(o_src, ref, rlAtCurr))
         if (rlAtCurr <= 2) or (o_src == 0) or (ref<0):
             dc.append(data[o_src])
             mask = mask | (1 << (mask_count-1))
@@ -156,7 +451,7 @@ def yay0Enc(data):
                 # mask bit is 0 by default.
             else:
                 if (o_src+1) < src_size:
-                    (ref_next, rlAtNext) = checkRunlength(o_src+1, src_size, data, maxOffset, maxRunLength)
+                    (ref_next, rlAtNext) = finder.find(o_src+1)
                 else:
                     (ref_next, rlAtNext) = (-1, 0)
                 if rlAtNext >= (rlAtCurr+prec_pos+2):
@@ -189,16 +484,19 @@ def yay0Enc(data):
             o_mt += 4 # increment by 4 since the mask is 4 bytes long.
             mask = 0
             mask_count = 32
-        log.debug("Encoded.")
+        if trace:
+            log.debug("Encoded.")
     if mask_count != 32:
         mt = mt + mask.to_bytes(4, byteorder='big')
         o_mt += 4
+    if progress is not None:
+        progress(src_size, src_size)
 
     #Compose dst buffer by concatenating the prefix, size, lt offset (which is size of mt+16 bytes header),
     # dc offset (which is lt_offset + lt size), mt, lt and dc.
     dst = b'Yay0' + struct.pack(">I",src_size) + struct.pack(">I", (o_mt+16)) + struct.pack(">I", (o_mt+o_lt+16))
     log.debug("Mask Table {} bytes, Link Table {} bytes, DC {} bytes".format(o_mt, o_lt, o_dc))
-    log.debug("Masks {} {} Links {} {} DCs {} {}".format(mt[0:4], mt[4:8], lt[0:2], lt[2:4], dc[0], dc[1]))
+    log.debug("Masks {} {} Links {} {} DCs {} {}".format(mt[0:4], mt[4:8], lt[0:2], lt[2:4], dc[0:1], dc[1:2]))
     log.info("Created Header: {}".format(dst))
     dst = dst + mt + lt + dc
     return dst